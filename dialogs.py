@@ -230,10 +230,11 @@ class AttrDialog(QDialog):
         return out
 
     def _save_presets(self) -> None:
-        self._settings.setValue(
-            self._preset_key,
-            json.dumps(self._presets, ensure_ascii=False)
-        )
+        raw = json.dumps(self._presets, ensure_ascii=False)
+        # 内容が変わらなければ書き込まない（QSettings の書き出しを省く）
+        if raw == (self._settings.value(self._preset_key, "", type=str) or ""):
+            return
+        self._settings.setValue(self._preset_key, raw)
 
     def _refresh_preset_combo(self) -> None:
         cur = self.preset_combo.currentText()
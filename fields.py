@@ -1,6 +1,6 @@
 # fields.py
 from qgis.PyQt.QtCore import QVariant
-from qgis.core import QgsField, QgsVectorLayer
+from qgis.core import QgsField, QgsVectorLayer, QgsVectorDataProvider
 from typing import List, Optional, Tuple, Dict
 from contextlib import contextmanager
 from collections import OrderedDict
@@ -119,10 +119,7 @@ def apply_schema(layer: QgsVectorLayer, extra_fields: Optional[List[str]] = None
                 f.setLength(length)
             adds.append(f)
 
-    if adds:
-        with edit(layer):
-            layer.dataProvider().addAttributes(adds)
-            layer.updateFields()
+    add_fields(layer, adds)
 
 
 def normalize_category(raw: str) -> str:
@@ -163,3 +160,24 @@ def edit(layer: QgsVectorLayer):
         if started_here:
             layer.rollBack()
         raise
+
+
+def add_fields(layer: QgsVectorLayer, new_fields: List[QgsField]) -> None:
+    """
+    フィールドを追加する。編集中でなくプロバイダが直接追加できる場合（memory / OGR）は
+    編集セッションを開かずにプロバイダへ渡す（開始・コミットのシグナルと再描画を省く）
+    """
+    if not new_fields:
+        return
+    prov = layer.dataProvider()
+    if not layer.isEditable():
+        try:
+            direct = bool(prov.capabilities() & QgsVectorDataProvider.AddAttributes)
+        except Exception:
+            direct = False
+        if direct and prov.addAttributes(new_fields):
+            layer.updateFields()
+            return
+    with edit(layer):
+        prov.addAttributes(new_fields)
+        layer.updateFields()
@@ -0,0 +1,258 @@
+# images.py
+import os
+import stat
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+from qgis.PyQt.QtCore import QObject, QRunnable, QSize, QThreadPool, pyqtSignal
+from qgis.PyQt.QtGui import QImage, QImageReader, QPixmap
+
+from .ui import _qt_enum
+
+PIXMAP_CACHE_KB = 256 * 1024  # 手元の 2Q キャッシュの上限（QGIS 共有の QPixmapCache は使わない）
+PREFETCH_MAX_BYTES = 64 * 1024 * 1024  # これより大きい画像は先読みしない
+WIDTH_STEP = 256  # デコード幅の刻み（少しのリサイズでは再デコードしない）
+
+
+_FMT_RGB32 = _qt_enum(QImage, "Format.Format_RGB32", "Format_RGB32")
+_FMT_ARGB32_PM = _qt_enum(QImage, "Format.Format_ARGB32_Premultiplied", "Format_ARGB32_Premultiplied")
+
+
+def width_bucket(target_w: int) -> int:
+    """表示幅を WIDTH_STEP 単位に切り上げる（0 以下は原寸）"""
+    if target_w <= 0:
+        return 0
+    return -(-target_w // WIDTH_STEP) * WIDTH_STEP
+
+
+@lru_cache(maxsize=4096)
+def _real_path(path: str) -> str:
+    return os.path.realpath(path)
+
+
+def clear_path_cache() -> None:
+    """画像フォルダを切り替えたときに実パスの解決結果を捨てる"""
+    _real_path.cache_clear()
+
+
+def pixmap_key(path: Path, target_w: int = 0) -> Optional[str]:
+    """
+    キャッシュ用のキー（実パス + 更新時刻 + デコード幅）。通常ファイルが無ければ None
+    front/back や前後の行が同じ画像を指していれば（相対表記・リンク違いでも）同じキーになる
+    stat は1回だけなので、存在確認（is_file）も兼ねる
+    """
+    real = _real_path(str(path))
+    try:
+        st = os.stat(real)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return f"{real}|{st.st_mtime_ns}|{width_bucket(target_w)}"
+
+
+def decode_image(path: str, target_w: int = 0) -> QImage:
+    """
+    target_w 幅に縮小しながらデコードする（JPEGはデコーダ側で 1/2,1/4,1/8 縮小される）
+    ワーカースレッドから呼べるよう QImage を返す
+    形式は RGB32（透過ありは ARGB32_Premultiplied）にそろえる（グレースケール/パレット画像など）
+    """
+    reader = QImageReader(path)
+    w = width_bucket(target_w)
+    size = reader.size()
+    if w > 0 and size.isValid() and size.width() > w:
+        h = max(1, round(size.height() * w / size.width()))
+        reader.setScaledSize(QSize(w, h))
+    img = reader.read()
+    if not img.isNull() and img.format() not in (_FMT_RGB32, _FMT_ARGB32_PM):
+        img = img.convertToFormat(_FMT_ARGB32_PM if img.hasAlphaChannel() else _FMT_RGB32)
+    return img
+
+
+def _pixmap_bytes(pix: QPixmap) -> int:
+    return pix.width() * pix.height() * max(1, pix.depth() // 8)
+
+
+class _TwoQueueCache:
+    """
+    2Q キャッシュ（バイト数で上限管理）
+    - a1in : 初めて入った画像の FIFO（一度しか見ない画像はここで流れる）
+    - a1out: a1in から追い出したキーだけを覚えるゴースト
+    - am   : 再訪された画像の LRU（前後を行き来する画像はここに残る）
+    大きな画像1枚で小さな画像がまとめて追い出される LRU の弱点を避ける
+    """
+
+    def __init__(self, max_bytes: int, in_ratio: float = 0.25, ghost_max: int = 1024):
+        self.max_bytes = max_bytes
+        self.in_bytes_max = int(max_bytes * in_ratio)
+        self.ghost_max = ghost_max
+        self.a1in: "OrderedDict[str, QPixmap]" = OrderedDict()
+        self.a1out: "OrderedDict[str, None]" = OrderedDict()
+        self.am: "OrderedDict[str, QPixmap]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._in_bytes = 0
+        self._total = 0
+
+    def get(self, key: str) -> Optional[QPixmap]:
+        pix = self.am.get(key)
+        if pix is not None:
+            self.am.move_to_end(key)
+            return pix
+        pix = self.a1in.pop(key, None)
+        if pix is not None:
+            self._in_bytes -= self._sizes[key]
+            self.am[key] = pix
+        return pix
+
+    def put(self, key: str, pix: QPixmap):
+        size = _pixmap_bytes(pix)
+        if size > self.max_bytes:
+            return
+        self._discard(key)
+        if key in self.a1out:
+            # 追い出された後にまた来た＝再訪される画像なので am に入れる
+            del self.a1out[key]
+            self.am[key] = pix
+        else:
+            self.a1in[key] = pix
+            self._in_bytes += size
+        self._sizes[key] = size
+        self._total += size
+        self._evict()
+
+    def clear(self):
+        self.a1in.clear()
+        self.a1out.clear()
+        self.am.clear()
+        self._sizes.clear()
+        self._in_bytes = 0
+        self._total = 0
+
+    def _discard(self, key: str):
+        if key in self.am:
+            del self.am[key]
+        elif key in self.a1in:
+            del self.a1in[key]
+            self._in_bytes -= self._sizes[key]
+        else:
+            return
+        self._total -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self._total > self.max_bytes:
+            if self.a1in and (self._in_bytes > self.in_bytes_max or not self.am):
+                key, _ = self.a1in.popitem(last=False)
+                size = self._sizes.pop(key)
+                self._in_bytes -= size
+                self._total -= size
+                self.a1out[key] = None
+                while len(self.a1out) > self.ghost_max:
+                    self.a1out.popitem(last=False)
+            else:
+                key, _ = self.am.popitem(last=False)
+                self._total -= self._sizes.pop(key)
+
+
+# 表示/先読みした画像はプラグイン専用の 2Q キャッシュだけに持つ
+# （QGIS 本体と共有の QPixmapCache の上限は変えず、同じ画像を二重に持たない）
+_cache = _TwoQueueCache(PIXMAP_CACHE_KB * 1024)
+
+
+def store_pixmap(key: str, pix: QPixmap):
+    _cache.put(key, pix)
+
+
+def find_cached(key: str) -> Optional[QPixmap]:
+    return _cache.get(key)
+
+
+def clear_cache() -> None:
+    """キャッシュした画像を手放す（プラグインのアンロード時）"""
+    _cache.clear()
+
+
+PREFETCH_PRIORITY = -1  # 表示用デコード（0）より後回しにする
+
+
+class _DecodeSignals(QObject):
+    decoded = pyqtSignal(str, QImage)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.epoch = 0  # 先読みの世代。上がったら古い先読みタスクは何もしない
+
+
+class _DecodeTask(QRunnable):
+    # QPixmap はGUIスレッド専用なので、ワーカーでは QImage までデコードする
+    def __init__(self, key: str, path: str, target_w: int, signals: _DecodeSignals,
+                 epoch: Optional[int] = None):
+        super().__init__()
+        self.setAutoDelete(True)
+        self.key = key
+        self.path = path
+        self.target_w = target_w
+        self.signals = signals
+        self.epoch = epoch
+
+    def run(self):
+        if self.epoch is not None and self.epoch != self.signals.epoch:
+            return
+        img = decode_image(self.path, self.target_w)
+        self.signals.decoded.emit(self.key, img)
+
+
+class PixmapPrefetcher(QObject):
+    """
+    画像をバックグラウンドでデコードしてキャッシュに積む
+    - request: 表示用。完了時に loaded(key, pixmap) を流す（失敗時は null の QPixmap）
+    - prefetch: 前後の画像の先読み（キャッシュに積むだけ）
+    """
+    loaded = pyqtSignal(str, QPixmap)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pool = QThreadPool.globalInstance()
+        self._inflight: Set[str] = set()
+        self._prefetching: Set[str] = set()
+        self._signals = _DecodeSignals()
+        self._signals.decoded.connect(self._on_decoded)
+
+    def request(self, key: str, path: Path, target_w: int = 0):
+        # 先読み中のものは取り消されうるので、表示用として改めて積む
+        if key not in self._inflight or key in self._prefetching:
+            self._inflight.add(key)
+            self._prefetching.discard(key)
+            self._pool.start(_DecodeTask(key, str(path), target_w, self._signals))
+
+    def prefetch(self, paths: Iterable[Path], target_w: int = 0):
+        for path in paths:
+            real = _real_path(str(path))
+            try:
+                st = os.stat(real)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode) or st.st_size > PREFETCH_MAX_BYTES:
+                continue
+            key = f"{real}|{st.st_mtime_ns}|{width_bucket(target_w)}"
+            if key in self._inflight or find_cached(key) is not None:
+                continue
+            self._inflight.add(key)
+            self._prefetching.add(key)
+            task = _DecodeTask(key, str(path), target_w, self._signals, self._signals.epoch)
+            self._pool.start(task, PREFETCH_PRIORITY)
+
+    def cancel_prefetch(self):
+        """まだ始まっていない先読みを無効にする（離れた行へジャンプしたとき）"""
+        self._signals.epoch += 1
+        self._inflight -= self._prefetching
+        self._prefetching.clear()
+
+    def _on_decoded(self, key: str, img: QImage):
+        self._inflight.discard(key)
+        self._prefetching.discard(key)
+        pix = QPixmap() if img is None or img.isNull() else QPixmap.fromImage(img)
+        if not pix.isNull():
+            store_pixmap(key, pix)
+        self.loaded.emit(key, pix)
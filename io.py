@@ -1,30 +1,250 @@
 #io.py
 from __future__ import annotations
 import csv, json
+from bisect import bisect_left
 from pathlib import Path
 from typing import List, Optional, Callable, Tuple, Dict
 
-from qgis.core import QgsFeature, QgsGeometry
+from qgis.core import QgsFeature, QgsFeatureRequest, QgsGeometry
 
 from .utils import (
-    Row, open_with_fallback, parse_float, header_map, normalize_header,
-    detect_csv_dialect, transform_point, export_layer_to_csv, resolve_path,EditContext
+    Row, open_with_fallback, header_map, normalize_header,
+    detect_csv_dialect, transform_point, export_layer_to_csv, resolve_path, EditContext, safe_str,
 )
 from .fields import FN
 
+try:
+    # 画像CSVの高速読込用。無ければ csv モジュールで読む
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = None
+    pc = None
+    pa_csv = None
+
+_ROW_STR_COLS = ("kp", "street", "pic_front", "pic_back")
+_ROW_FLOAT_COLS = (
+    "lat_kp", "lon_kp", "lat_front", "lon_front", "course_front",
+    "lat_back", "lon_back", "course_back",
+)
+
+def _append_rows(rows: List[Row], n: int, data: Dict[str, list], has_kp: bool,
+                 first_line: int = 2, bad_rows: Optional[Dict[int, str]] = None,
+                 line_nos: Optional[List[int]] = None,
+                 skip_log: Optional[List[Tuple[int, str]]] = None) -> None:
+    """列ごとのリスト（data[key]）から Row を組み立てて rows に追加する
+    bad_rows: {行位置: 理由}（数値に変換できなかった行。理由を出してスキップする）
+    （line_nos があれば、スキップ時の行番号はそれを使う。skip_log があれば出力せずそこに溜める）"""
+    empty = [""] * n
+    none = [None] * n
+    kp, street, pf, pb = (data.get(k, empty) for k in _ROW_STR_COLS)
+    lat_kp, lon_kp = (data.get(k, none) if has_kp else none for k in ("lat_kp", "lon_kp"))
+    lat_f, lon_f, cf = (data.get(k, none) for k in ("lat_front", "lon_front", "course_front"))
+    lat_b, lon_b, cb = (data.get(k, none) for k in ("lat_back", "lon_back", "course_back"))
+    # 列を一度だけ zip して行タプルにする（行ごとの添字アクセスをしない）
+    append = rows.append
+    cols = zip(kp, lat_kp, lon_kp, street, pf, lat_f, lon_f, cf, pb, lat_b, lon_b, cb)
+    for i, (k, lk, lok, st, f, lf, lof, c_f, b, lb, lob, c_b) in enumerate(cols):
+        f = (f or "").strip()
+        b = (b or "").strip()
+        if not f and not b and not has_kp:
+            continue
+        if bad_rows and i in bad_rows:
+            line = line_nos[i] if line_nos is not None else i + first_line
+            msg = f"[io.load_images_csv] Skipped line {line}: {bad_rows[i]}"
+            if skip_log is None:
+                print(msg)
+            else:
+                skip_log.append((line, msg))
+            continue
+        append(Row((k or "").strip(), lk, lok, (st or "").strip(), f, lf, lof, c_f, b, lb, lob, c_b))
+
+def _float_column(values: List[str]) -> Tuple[list, Dict[int, str]]:
+    """文字列の列をまとめて float にする（空は None）。変換できなかった位置と理由も返す"""
+    try:
+        # 空欄も不正値も無い列（大半の座標列）は map 1回で済ませる（float は前後の空白を許す）
+        return list(map(float, values)), {}
+    except ValueError:
+        pass
+    out: list = []
+    bad: Dict[int, str] = {}
+    append = out.append
+    for i, v in enumerate(values):
+        v = v.strip()
+        if not v:
+            append(None)
+            continue
+        try:
+            append(float(v))
+        except ValueError as e:
+            append(None)
+            bad[i] = str(e)
+    return out, bad
+
+_CSV_CHUNK_ROWS = 50_000
+_REQUIRED_COLS = ("kp", "pic_front", "lat_front", "lon_front", "pic_back", "lat_back", "lon_back")
+_SHORT_ROW_MSG = "too few columns"
+
+_ARROW_BLOCK_SIZE = 8 << 20
+
+def _arrow_float_column(arr) -> Tuple[list, Dict[int, str]]:
+    """文字列の列を float にする。Arrow でまとめて変換できない列（空白付き・不正値など）は float() で1件ずつ"""
+    try:
+        empty = pc.equal(arr, "")
+        return pc.cast(pc.if_else(empty, pa.scalar(None, pa.string()), arr), pa.float64()).to_pylist(), {}
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return _float_column(arr.to_pylist())
+
+def _record_number(start: int, k: int, skipped: List[int]) -> int:
+    """行番号 start から数えて k 件目（0始まり）の読んだ行の行番号（skipped は飛ばした行番号の昇順リスト）"""
+    line = start + k
+    for s in skipped[bisect_left(skipped, start):]:
+        if s > line:
+            break
+        line += 1
+    return line
+
+def _load_images_arrow(csv_path: str, enc: str, dialect, col: Dict[str, int], width: int, min_cols: int,
+                       on_progress: Optional[Callable[[int], None]] = None) -> Optional[List[Row]]:
+    """
+    pyarrow のストリーミングCSVリーダーでバッチ単位に読む高速経路（pyarrow が無い/読めない場合は None で csv 経路へ）
+    csv 経路と同じく、必須列まで届かない短い行と数値に変換できない値の行だけをスキップする
+    （列数が合わない行は csv モジュールで読み直し、足りない任意列は空欄として元の順に差し込む）
+    """
+    if pa_csv is None:
+        return None
+    # 列は名前ではなく位置で選ぶ（正規化後に同名になる列は csv 経路と同じく後ろを使う）
+    cols = {k: f"c{col[k]}" for k in _ROW_STR_COLS + _ROW_FLOAT_COLS if k in col}
+    has_kp = "lat_kp" in cols and "lon_kp" in cols
+
+    skipped: List[int] = []  # Arrow が読まなかった行の行番号（数値エラーの行番号をずらさないため）
+    recovered: List[Tuple[int, List[str]]] = []  # 列数が合わない行（行番号, 読み直した値）
+    # スキップ理由は読み切れたときだけ出す（途中で csv 経路に切り替えると二重に出るため）
+    skip_log: List[Tuple[int, str]] = []
+
+    def _on_invalid_row(row):
+        if row.number is None:
+            return "error"
+        skipped.append(row.number)
+        fields = next(csv.reader(row.text.splitlines(True), dialect=dialect), [])
+        if len(fields) < min_cols:
+            skip_log.append((row.number, f"[io.load_images_csv] Skipped line {row.number}: {_SHORT_ROW_MSG}"))
+        else:
+            recovered.append((row.number, fields))
+        return "skip"
+
+    try:
+        reader = pa_csv.open_csv(
+            csv_path,
+            read_options=pa_csv.ReadOptions(
+                encoding=enc, block_size=_ARROW_BLOCK_SIZE, use_threads=False,
+                column_names=[f"c{i}" for i in range(width)], skip_rows_after_names=1,
+            ),
+            parse_options=pa_csv.ParseOptions(
+                delimiter=dialect.delimiter, quote_char=dialect.quotechar or False,
+                double_quote=dialect.doublequote, escape_char=dialect.escapechar or False,
+                newlines_in_values=True, invalid_row_handler=_on_invalid_row,
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={orig: pa.string() for orig in cols.values()},
+                include_columns=list(cols.values()), strings_can_be_null=False,
+            ),
+        )
+    except Exception:
+        return None
+
+    float_keys = [k for k in cols if k in _ROW_FLOAT_COLS and (has_kp or k not in ("lat_kp", "lon_kp"))]
+    rows: List[Row] = []
+    done = 0
+    start = 2  # このバッチ先頭の行番号（ヘッダが1行目）
+    ri = 0  # recovered のうち差し込み済みの件数
+    while True:
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            batch = None
+        except Exception:
+            return None
+        n = batch.num_rows if batch is not None else 0
+        if batch is not None and not n:
+            continue
+        # このバッチの最後の行までに読み直した行（最後は残り全部）
+        end = _record_number(start, n - 1, skipped) if n else None
+        ri_end = ri
+        while ri_end < len(recovered) and (end is None or recovered[ri_end][0] <= end):
+            ri_end += 1
+        extra = recovered[ri:ri_end]
+        ri = ri_end
+        if batch is None and not extra:
+            break
+
+        data: Dict[str, list] = {}
+        bad_rows: Dict[int, str] = {}
+        line_nos = None
+        if not extra:
+            for k, orig in cols.items():
+                arr = batch.column(batch.schema.get_field_index(orig))
+                if k in float_keys:
+                    data[k], bad = _arrow_float_column(arr)
+                    for i, msg in bad.items():
+                        bad_rows.setdefault(i, msg)
+                elif k in _ROW_STR_COLS:
+                    data[k] = arr.to_pylist()
+            if bad_rows:
+                line_nos = [_record_number(start, i, skipped) if i in bad_rows else 0 for i in range(n)]
+        else:
+            # 読み直した行があるバッチは文字列のまま行番号順に並べ、数値は csv 経路と同じく変換する
+            lines = [_record_number(start, i, skipped) for i in range(n)]
+            strs = {k: batch.column(batch.schema.get_field_index(orig)).to_pylist() if n else []
+                    for k, orig in cols.items()}
+            data = {k: [] for k in cols}
+            line_nos = []
+            j = 0
+            for num, fields in extra:
+                j2 = bisect_left(lines, num, j)
+                for k in cols:
+                    data[k].extend(strs[k][j:j2])
+                    c = col[k]
+                    data[k].append(fields[c] if c < len(fields) else "")
+                line_nos.extend(lines[j:j2])
+                line_nos.append(num)
+                j = j2
+            for k in cols:
+                data[k].extend(strs[k][j:])
+            line_nos.extend(lines[j:])
+            for k in float_keys:
+                data[k], bad = _float_column(data[k])
+                for i, msg in bad.items():
+                    bad_rows.setdefault(i, msg)
+        total = n + len(extra)
+        if total:
+            _append_rows(rows, total, data, has_kp, bad_rows=bad_rows, line_nos=line_nos, skip_log=skip_log)
+        if n:
+            start = end + 1
+        done += total
+        if on_progress and total:
+            on_progress(done)
+        if batch is None:
+            break
+    for _, msg in sorted(skip_log):
+        print(msg)
+    return rows
+
 # ========== 画像CSVのロード（UI依存なし） ==========
 def load_images_csv(csv_path: str, on_progress: Optional[Callable[[int], None]] = None) -> List[Row]:
     rows: List[Row] = []
     f, enc = open_with_fallback(csv_path)
     with f:
         dialect = detect_csv_dialect(f)
-        rdr = csv.DictReader(f, dialect=dialect)
-        headers = header_map(rdr.fieldnames or [])
+        rdr = csv.reader(f, dialect=dialect)
+        fieldnames = next(rdr, None) or []
+        norm = [normalize_header(h) for h in fieldnames]
+        headers = header_map(fieldnames, norm)
 
-        required = {"kp", "pic_front", "lat_front", "lon_front", "pic_back", "lat_back", "lon_back"}
-        missing = sorted(required - set(headers.keys()))
+        missing = sorted(set(_REQUIRED_COLS) - set(headers.keys()))
         if missing:
-            detected = ", ".join([normalize_header(h) for h in (rdr.fieldnames or [])])
+            detected = ", ".join(norm)
             raise Exception(
                 "Missing required CSV headers.\n"
                 f"Missing: {', '.join(missing)}\n"
@@ -34,52 +254,90 @@ def load_images_csv(csv_path: str, on_progress: Optional[Callable[[int], None]]
                 f"Detected delimiter: {repr(dialect.delimiter)} / Encoding: {enc}"
             )
 
-        has_cf = "course_front" in headers
-        has_cb = "course_back" in headers
+        # 列位置はヘッダから一度だけ決め、行はリストとして位置で読む（後ろの同名列が優先）
+        col = {n: idx for idx, n in enumerate(norm)}
+        # 必須列のいちばん右の位置。ここまで届かない短い行はスキップする（任意列の不足は空欄扱い）
+        min_len = max(col[k] for k in _REQUIRED_COLS) + 1
+
+        width = len(fieldnames)
+        fast = _load_images_arrow(csv_path, enc, dialect, col, width, min_len, on_progress)
+        if fast is not None:
+            if not fast:
+                raise Exception("No valid rows could be read from the CSV")
+            return fast
+
         has_kp = "lat_kp" in headers and "lon_kp" in headers
-        has_st = "street" in headers
 
+        # 文字列のまま列ごとに溜め、数値はチャンク単位で列ごとにまとめて変換する
+        use = [(k, col[k]) for k in _ROW_STR_COLS + _ROW_FLOAT_COLS if k in col]
+        float_keys = [
+            k for k, _ in use
+            if k in _ROW_FLOAT_COLS and (has_kp or k not in ("lat_kp", "lon_kp"))
+        ]
+
+        def _flush(data: Dict[str, list], line_nos: List[int], skip_log: List[Tuple[int, str]]):
+            bad_rows: Dict[int, str] = {}
+            for k in float_keys:
+                data[k], bad = _float_column(data[k])
+                for i, msg in bad.items():
+                    bad_rows.setdefault(i, msg)
+            _append_rows(rows, len(line_nos), data, has_kp, bad_rows=bad_rows, line_nos=line_nos,
+                         skip_log=skip_log)
+            # スキップ理由は行番号順に出す
+            for _, msg in sorted(skip_log):
+                print(msg)
+
+        data = {k: [] for k, _ in use}
+        line_nos: List[int] = []
+        skip_log: List[Tuple[int, str]] = []
         for i, row in enumerate(rdr, start=2):
             if on_progress and (i % 2000 == 0):
                 on_progress(i)
-            try:
-                kp = (row[headers["kp"]] or "").strip()
-                pf = (row[headers["pic_front"]] or "").strip()
-                pb = (row[headers["pic_back"]] or "").strip()
-                if not pf and not pb and not has_kp:
+            if not row:
+                continue
+            if len(row) < width:
+                if len(row) < min_len:
+                    skip_log.append((i, f"[io.load_images_csv] Skipped line {i}: {_SHORT_ROW_MSG}"))
                     continue
-                street = (row[headers["street"]].strip() if has_st else "")
-                lat_kp = parse_float(row[headers["lat_kp"]]) if has_kp else None
-                lon_kp = parse_float(row[headers["lon_kp"]]) if has_kp else None
-                lat_f = parse_float(row[headers["lat_front"]])
-                lon_f = parse_float(row[headers["lon_front"]])
-                lat_b = parse_float(row[headers["lat_back"]])
-                lon_b = parse_float(row[headers["lon_back"]])
-                cf = parse_float(row[headers["course_front"]]) if has_cf else None
-                cb = parse_float(row[headers["course_back"]]) if has_cb else None
-                rows.append(Row(kp, lat_kp, lon_kp, street, pf, lat_f, lon_f, cf, pb, lat_b, lon_b, cb))
-            except Exception as e:
-                print(f"[io.load_images_csv] Skipped line {i}: {e}")
+                row += [""] * (width - len(row))
+            for k, c in use:
+                data[k].append(row[c])
+            line_nos.append(i)
+            if len(line_nos) >= _CSV_CHUNK_ROWS:
+                _flush(data, line_nos, skip_log)
+                data = {k: [] for k, _ in use}
+                line_nos = []
+                skip_log = []
+        if line_nos or skip_log:
+            _flush(data, line_nos, skip_log)
     if not rows:
         raise Exception("No valid rows could be read from the CSV")
     return rows
 
 # ========== Clicks のエクスポート（UI依存なし） ==========
-def export_clicks_csv(layer, out_csv: str, only_selected: bool, meta: Optional[Dict] = None) -> Tuple[str, Optional[str]]:
+def clicks_csv_path(out_csv: str) -> str:
+    """拡張子を .csv にそろえ、出力先フォルダを作る"""
     p = Path(out_csv)
     if p.suffix.lower() != ".csv":
         out_csv = str(p.with_suffix(".csv"))
     Path(out_csv).parent.mkdir(parents=True, exist_ok=True)
+    return out_csv
 
-    export_layer_to_csv(layer, out_csv, only_selected=only_selected)
 
-    meta_path = None
-    if meta is not None:
-        meta_path = str(Path(out_csv)) + ".meta.json"
-        with open(meta_path, "w", encoding="utf-8") as mf:
-            json.dump(meta, mf, ensure_ascii=False, indent=2)
+def write_clicks_meta(out_csv: str, meta: Optional[Dict]) -> Optional[str]:
+    """CSVの隣に <csv>.meta.json を書く（meta が None なら何もしない）"""
+    if meta is None:
+        return None
+    meta_path = str(Path(out_csv)) + ".meta.json"
+    with open(meta_path, "w", encoding="utf-8") as mf:
+        json.dump(meta, mf, ensure_ascii=False, indent=2)
+    return meta_path
 
-    return out_csv, meta_path
+
+def export_clicks_csv(layer, out_csv: str, only_selected: bool, meta: Optional[Dict] = None) -> Tuple[str, Optional[str]]:
+    out_csv = clicks_csv_path(out_csv)
+    export_layer_to_csv(layer, out_csv, only_selected=only_selected)
+    return out_csv, write_clicks_meta(out_csv, meta)
 
 
 # ========== Clicks のインポート（UI依存なし） ==========
@@ -114,11 +372,12 @@ def import_clicks_csv(
     with f:
         dialect = detect_csv_dialect(f)
         rdr = csv.DictReader(f, dialect=dialect)
-        headers = header_map(rdr.fieldnames or [])
+        norm = [normalize_header(h) for h in (rdr.fieldnames or [])]
+        headers = header_map(rdr.fieldnames, norm)
         required = {"lat", "lon"}
         missing = sorted(required - set(headers.keys()))
         if missing:
-            detected = ", ".join([normalize_header(h) for h in (rdr.fieldnames or [])])
+            detected = ", ".join(norm)
             raise Exception(
                 "Missing required CSV headers.\n"
                 f"Missing: {', '.join(missing)}\n"
@@ -129,7 +388,8 @@ def import_clicks_csv(
 
         if clear:
             with EditContext(layer):
-                ids = [f.id() for f in layer.getFeatures()]
+                req = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([])
+                ids = [f.id() for f in layer.getFeatures(req)]
                 if ids:
                     layer.deleteFeatures(ids)
 
@@ -142,13 +402,7 @@ def import_clicks_csv(
                 return None
 
         def _gs(row, *keys):
-            for k in keys:
-                if k in headers:
-                    try:
-                        return (row[headers[k]] or "").strip()
-                    except Exception:
-                        pass
-            return ""
+            return safe_str(row, headers, *keys)
 
         with EditContext(layer):
             for i, row in enumerate(rdr, start=2):
@@ -1,13 +1,19 @@
 # layers.py
-from typing import List, Optional, Tuple
+import math
+import struct
+from typing import Dict, List, Optional, Tuple
 from qgis.PyQt.QtCore import QVariant
 from qgis.core import (QgsVectorLayer, QgsProject, QgsField, 
-                       QgsGeometry, QgsPointXY, QgsFeature,
-                       QgsFeatureRequest,)
+                       QgsGeometry, QgsFeature,
+                       QgsFeatureRequest, QgsFeatureSink, QgsExpression,
+                       QgsRectangle, QgsWkbTypes,)
 
 from .utils import EditContext
 from .symbology import apply_category_symbology, apply_click_count_labels
-from .fields import FN, apply_schema
+from .fields import FN, apply_schema, add_fields
+
+# 点ジオメトリの WKB（リトルエンディアン, wkbPoint=1, x, y の21バイト）
+_WKB_POINT = struct.Struct("<BIdd")
 
 # フィールド名ごとの標準型（必要最低限）
 _FIELD_TYPE_MAP = {
@@ -28,9 +34,18 @@ _FIELD_TYPE_MAP = {
 }
 
 def _get_existing_layer(name: str) -> QgsVectorLayer:
-    proj = QgsProject.instance()
-    layers = proj.mapLayersByName(name)
-    return layers[0] if layers else None
+    """同名のポイントレイヤ（名前の一致は QGIS 側で引く。同名のラスタ等は無視）"""
+    for lyr in QgsProject.instance().mapLayersByName(name):
+        if isinstance(lyr, QgsVectorLayer) and lyr.geometryType() == QgsWkbTypes.PointGeometry:
+            return lyr
+    return None
+
+def _create_spatial_index(lyr: QgsVectorLayer):
+    """メモリレイヤに空間インデックスを作成（矩形フィルタ・最近傍検索を高速化）"""
+    try:
+        lyr.dataProvider().createSpatialIndex()
+    except Exception:
+        pass
 
 def ensure_point_layer(name: str) -> QgsVectorLayer:
     exist = _get_existing_layer(name)
@@ -50,6 +65,7 @@ def ensure_point_layer(name: str) -> QgsVectorLayer:
     if not lyr.isValid():
         raise Exception("Failed to create point layer.")
     QgsProject.instance().addMapLayer(lyr)
+    _create_spatial_index(lyr)
     apply_schema(lyr)  # 念のため不足分を補う
     return lyr
 
@@ -79,6 +95,7 @@ def ensure_click_layer(
     if not lyr.isValid():
         raise Exception("Failed to create click layer.")
     QgsProject.instance().addMapLayer(lyr)
+    _create_spatial_index(lyr)
     apply_schema(lyr, extra_fields)
     apply_category_symbology(
         lyr,
@@ -90,16 +107,15 @@ def ensure_click_layer(
     return lyr
 
 def ensure_fields(lyr: QgsVectorLayer, keys: List[str]):
+    if not keys:
+        return
     names = set(lyr.fields().names())
     new_fields = []
     for k in keys:
         if k and k not in names:
             typ = _FIELD_TYPE_MAP.get(k, QVariant.String)
             new_fields.append(QgsField(k, typ))
-    if new_fields:
-        with EditContext(lyr):
-            lyr.dataProvider().addAttributes(new_fields)
-            lyr.updateFields()
+    add_fields(lyr, new_fields)
 
 def plot_all_points(layer: QgsVectorLayer, rows: List, info_cb=None):
     required_fields = [
@@ -112,79 +128,79 @@ def plot_all_points(layer: QgsVectorLayer, rows: List, info_cb=None):
     ensure_fields(layer, required_fields)
 
     prov = layer.dataProvider()
-    idx = {n: layer.fields().indexFromName(n) for n in layer.fields().names()}
+    fields = layer.fields()
+    n_fields = fields.count()
+    (kp_i, side_i, jpg_i, street_i, pf_i, pb_i,
+     lat_i, lon_i, cf_i, cb_i, sel_i, cat_i, sub_i) = (
+        fields.indexFromName(n) for n in required_fields
+    )
     new_feats = []
-
-    with EditContext(layer):
-        layer.deleteFeatures([f.id() for f in layer.getFeatures()])
-
-        for r in rows:
-            # ---- KP ----
-            if getattr(r, "lat_kp", None) is not None and getattr(r, "lon_kp", None) is not None:
-                f = QgsFeature(layer.fields())
-                f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(r.lon_kp, r.lat_kp)))
-                f.setAttribute(idx["kp"],        r.kp)
-                f.setAttribute(idx["side"],      "kp")
-                f.setAttribute(idx[FN.JPG],      "")
-                f.setAttribute(idx["street"],    r.street or "")
-                f.setAttribute(idx["pic_front"], r.front or "")
-                f.setAttribute(idx["pic_back"],  r.back or "")
-                f.setAttribute(idx[FN.LAT],      r.lat_kp)
-                f.setAttribute(idx[FN.LON],      r.lon_kp)
-                f.setAttribute(idx["is_sel"],    0)
-                if getattr(r, "category", None) is not None and FN.CATEGORY in idx:
-                    f.setAttribute(idx[FN.CATEGORY], r.category)
-                if getattr(r, "subcat", None) is not None and "subcat" in idx:
-                    f.setAttribute(idx["subcat"], r.subcat)
-                new_feats.append(f)
-
-            # ---- front ----
-            if getattr(r, "front", None) and getattr(r, "lat_front", None) is not None and getattr(r, "lon_front", None) is not None:
-                f = QgsFeature(layer.fields())
-                f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(r.lon_front, r.lat_front)))
-                f.setAttribute(idx["kp"],        r.kp)
-                f.setAttribute(idx["side"],      "front")
-                f.setAttribute(idx[FN.JPG],      r.front)
-                f.setAttribute(idx["street"],    r.street or "")
-                f.setAttribute(idx["pic_front"], r.front)
-                f.setAttribute(idx["pic_back"],  r.back or "")
-                f.setAttribute(idx[FN.LAT],      r.lat_front)
-                f.setAttribute(idx[FN.LON],      r.lon_front)
-                f.setAttribute(idx["is_sel"],    0)
-                cf = getattr(r, "course_front", None)
-                if "course_front" in idx and cf is not None:
-                    f.setAttribute(idx["course_front"], float(cf))
-                if getattr(r, "category", None) is not None and FN.CATEGORY in idx:
-                    f.setAttribute(idx[FN.CATEGORY], r.category)
-                if getattr(r, "subcat", None) is not None and "subcat" in idx:
-                    f.setAttribute(idx["subcat"], r.subcat)
-                new_feats.append(f)
-
-            # ---- back ----
-            if getattr(r, "back", None) and getattr(r, "lat_back", None) is not None and getattr(r, "lon_back", None) is not None:
-                f = QgsFeature(layer.fields())
-                f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(r.lon_back, r.lat_back)))
-                f.setAttribute(idx["kp"],        r.kp)
-                f.setAttribute(idx["side"],      "back")
-                f.setAttribute(idx[FN.JPG],      r.back)
-                f.setAttribute(idx["street"],    r.street or "")
-                f.setAttribute(idx["pic_front"], r.front or "")
-                f.setAttribute(idx["pic_back"],  r.back)
-                f.setAttribute(idx[FN.LAT],      r.lat_back)
-                f.setAttribute(idx[FN.LON],      r.lon_back)
-                f.setAttribute(idx["is_sel"],    0)
-                cb = getattr(r, "course_back", None)
-                if "course_back" in idx and cb is not None:
-                    f.setAttribute(idx["course_back"], float(cb))
-                if getattr(r, "category", None) is not None and FN.CATEGORY in idx:
-                    f.setAttribute(idx[FN.CATEGORY], r.category)
-                if getattr(r, "subcat", None) is not None and "subcat" in idx:
-                    f.setAttribute(idx["subcat"], r.subcat)
-                new_feats.append(f)
-
-        if new_feats:
-            if not prov.addFeatures(new_feats):
-                raise Exception("Failed to add features.")
+    pack_point = _WKB_POINT.pack
+    template = QgsFeature(fields)
+
+    def _make(r, side, jpg, lat, lon, course_i, course):
+        # 属性は1回の setAttributes でまとめて渡す
+        attrs = [None] * n_fields
+        attrs[kp_i] = r.kp
+        attrs[side_i] = side
+        attrs[jpg_i] = jpg
+        attrs[street_i] = street
+        attrs[pf_i] = front
+        attrs[pb_i] = back
+        attrs[lat_i] = lat
+        attrs[lon_i] = lon
+        attrs[sel_i] = 0
+        if course_i >= 0 and course is not None:
+            attrs[course_i] = float(course)
+        if category is not None and cat_i >= 0:
+            attrs[cat_i] = category
+        if subcat is not None and sub_i >= 0:
+            attrs[sub_i] = subcat
+        geom = QgsGeometry()
+        geom.fromWkb(pack_point(1, 1, lon, lat))
+        f = QgsFeature(template)
+        f.setGeometry(geom)
+        f.setAttributes(attrs)
+        new_feats.append(f)
+
+    # 既存点の全削除はプロバイダ側で一括（memory は中身を入れ替えるだけ）。
+    # 未対応のプロバイダだけ従来どおり fid を集めて削除する
+    try:
+        truncated = bool(prov.truncate())
+    except Exception:
+        truncated = False
+
+    if not truncated:
+        with EditContext(layer):
+            layer.deleteFeatures([f.id() for f in layer.getFeatures(
+                QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes([]))])
+
+    # 追加はプロバイダへ1回で渡す（編集バッファ・コミットを経由しない）
+    for r in rows:
+        street = r.street or ""
+        front = r.front or ""
+        back = r.back or ""
+        category = getattr(r, "category", None)
+        subcat = getattr(r, "subcat", None)
+        # ---- KP ----
+        if r.lat_kp is not None and r.lon_kp is not None:
+            _make(r, "kp", "", r.lat_kp, r.lon_kp, -1, None)
+        # ---- front ----
+        if front and r.lat_front is not None and r.lon_front is not None:
+            _make(r, "front", front, r.lat_front, r.lon_front, cf_i, r.course_front)
+        # ---- back ----
+        if back and r.lat_back is not None and r.lon_back is not None:
+            _make(r, "back", back, r.lat_back, r.lon_back, cb_i, r.course_back)
+
+    if new_feats:
+        ok, _ = prov.addFeatures(new_feats, QgsFeatureSink.FastInsert)
+        if not ok:
+            raise Exception("Failed to add features.")
+        # 座標での矩形検索（find_feature_by_pic_or_coord）用
+        try:
+            prov.createSpatialIndex()
+        except Exception:
+            pass
 
     layer.removeSelection()
     layer.triggerRepaint()
@@ -214,28 +230,64 @@ def apply_front_back_selected(layer, front_feat: Optional[QgsFeature], back_feat
     if layer is None:
         return
     fcache = fcache or FieldCache(layer)
-    if fcache.is_sf < 0 and fcache.is_sb < 0:
+    flag_cols = [
+        (idx, name, fid)
+        for idx, name, fid in (
+            (fcache.is_sf, "is_sel_front", front_feat.id() if front_feat else None),
+            (fcache.is_sb, "is_sel_back", back_feat.id() if back_feat else None),
+        )
+        if idx >= 0
+    ]
+    if not flag_cols:
         return
 
-    fid_front = front_feat.id() if front_feat else None
-    fid_back  = back_feat.id()  if back_feat  else None
-
+    # 全件は回さず、いまフラグが立っている点だけ（前回の表示分）を読んで差分だけ書く
+    expr = " OR ".join(f"{QgsExpression.quotedColumnRef(name)} = 1" for _, name, _ in flag_cols)
+    req = QgsFeatureRequest().setFilterExpression(expr)
+    req.setFlags(QgsFeatureRequest.NoGeometry)
+    req.setSubsetOfAttributes([idx for idx, _, _ in flag_cols])
+
+    changes: Dict[int, Dict[int, int]] = {}
+    already = set()
+    for f in layer.getFeatures(req):
+        fid = f.id()
+        for idx, _, want_fid in flag_cols:
+            try:
+                cur = int(f[idx] or 0)
+            except Exception:
+                cur = 0
+            want = 1 if fid == want_fid else 0
+            if cur != want:
+                changes.setdefault(fid, {})[idx] = want
+            elif want:
+                already.add((fid, idx))
+    for idx, _, want_fid in flag_cols:
+        if want_fid is not None and (want_fid, idx) not in already:
+            changes.setdefault(want_fid, {})[idx] = 1
+
+    if changes:
+        _write_attr_changes(layer, changes)
+        layer.triggerRepaint()
+
+def _write_attr_changes(layer, changes: Dict[int, Dict[int, object]]) -> None:
+    """{fid: {列index: 値}} をまとめて書き込む。
+    編集中でなければプロバイダへ1回で渡し、編集中のレイヤは従来どおり編集バッファ経由で書く"""
+    if not changes:
+        return
+    if not layer.isEditable():
+        try:
+            if layer.dataProvider().changeAttributeValues(changes):
+                return
+        except Exception:
+            pass
     with EditContext(layer):
-        for f in layer.getFeatures():
-            if fcache.is_sf >= 0:
-                want = 1 if (fid_front is not None and f.id() == fid_front) else 0
-                cur  = int(f[fcache.is_sf] or 0)
-                if cur != want:
-                    layer.changeAttributeValue(f.id(), fcache.is_sf, want)
-            if fcache.is_sb >= 0:
-                want = 1 if (fid_back is not None and f.id() == fid_back) else 0
-                cur  = int(f[fcache.is_sb] or 0)
-                if cur != want:
-                    layer.changeAttributeValue(f.id(), fcache.is_sb, want)
-    layer.triggerRepaint()
+        for fid, attrs in changes.items():
+            for idx, val in attrs.items():
+                layer.changeAttributeValue(fid, idx, val)
 
 # KP（side=kp）行の is_sel を 0/1 に更新
-def select_kp(layer, kp_value: str, fcache: Optional[FieldCache] = None):
+def select_kp(layer, kp_value: str, fcache: Optional[FieldCache] = None,
+              lookup: Optional["PointLookup"] = None):
     if not layer or not kp_value:
         return
     fcache = fcache or FieldCache(layer)
@@ -243,20 +295,109 @@ def select_kp(layer, kp_value: str, fcache: Optional[FieldCache] = None):
         return
 
     key = str(kp_value).strip().lower()
-    with EditContext(layer):
-        for f in layer.getFeatures():
+    # kp 点のうち、いま is_sel=1 のもの（前回の選択分）と今回の対象だけを読む
+    side_ref = QgsExpression.quotedColumnRef("side")
+    sel_ref = QgsExpression.quotedColumnRef("is_sel")
+    if lookup is not None:
+        want_fids = set(lookup.kp_fids.get(key, ()))
+        expr = f"lower(trim({side_ref})) = 'kp' AND {sel_ref} = 1"
+    else:
+        want_fids = None
+        kp_ref = QgsExpression.quotedColumnRef("kp")
+        expr = (
+            f"lower(trim({side_ref})) = 'kp' AND "
+            f"({sel_ref} = 1 OR lower(trim({kp_ref})) = {QgsExpression.quotedString(key)})"
+        )
+    req = QgsFeatureRequest().setFilterExpression(expr)
+    req.setFlags(QgsFeatureRequest.NoGeometry)
+    req.setSubsetOfAttributes([fcache.is_sel, fcache.side, fcache.kp])
+
+    changes: Dict[int, Dict[int, int]] = {}
+    already = set()
+    for f in layer.getFeatures(req):
+        try:
+            fid = f.id()
+            if want_fids is None:
+                want = 1 if str(f[fcache.kp]).strip().lower() == key else 0
+            else:
+                want = 1 if fid in want_fids else 0
+            cur  = int(f[fcache.is_sel] or 0)
+            if cur != want:
+                changes[fid] = {fcache.is_sel: want}
+            elif want:
+                already.add(fid)
+        except Exception:
+            pass
+    for fid in (want_fids or ()):
+        if fid not in already:
+            changes[fid] = {fcache.is_sel: 1}
+
+    if changes:
+        _write_attr_changes(layer, changes)
+        layer.triggerRepaint()
+
+class PointLookup:
+    """PhotoPoints の (side, 画像名) と座標グリッド → fid の索引。
+    plot_all_points 直後に1回作り、ナビゲーション毎の全件走査を避ける。
+    side="" のキーには全sideの候補も入れておく（expected_side 未指定用）。"""
+
+    def __init__(self, layer, tol: float = 1e-7):
+        self.tol = tol
+        self.by_jpg: Dict[Tuple[str, str], int] = {}
+        self.by_cell: Dict[Tuple[str, int, int], List[Tuple[int, float, float]]] = {}
+        # side="kp" の点：小文字化済み KP → fid（select_kp 用）
+        self.kp_fids: Dict[str, List[int]] = {}
+        self.all_kp_fids: List[int] = []
+
+        fcache = FieldCache(layer)
+        # 索引に使う列（これらの値やジオメトリが変わったら作り直しが必要）
+        self.key_fields = frozenset(i for i in (fcache.kp, fcache.side, fcache.jpg) if i >= 0)
+        req = QgsFeatureRequest().setSubsetOfAttributes(sorted(self.key_fields))
+        for f in layer.getFeatures(req):
             try:
-                if str(f[fcache.side]).strip().lower() == "kp":
-                    want = 1 if str(f[fcache.kp]).strip().lower() == key else 0
-                    cur  = int(f[fcache.is_sel] or 0)
-                    if cur != want:
-                        layer.changeAttributeValue(f.id(), fcache.is_sel, want)
+                fid = f.id()
+                side = str(f[fcache.side] or "").strip().lower() if fcache.side >= 0 else ""
+                if side == "kp" and fcache.kp >= 0:
+                    self.all_kp_fids.append(fid)
+                    self.kp_fids.setdefault(str(f[fcache.kp]).strip().lower(), []).append(fid)
+                sides = (side, "") if side else ("",)
+                jpg = str(f[fcache.jpg] or "").strip().lower() if fcache.jpg >= 0 else ""
+                if jpg:
+                    for s in sides:
+                        self.by_jpg.setdefault((s, jpg), fid)
+                pt = f.geometry().asPoint()
+                x, y = pt.x(), pt.y()
+                cx, cy = self._cell(x, y)
+                for s in sides:
+                    self.by_cell.setdefault((s, cx, cy), []).append((fid, x, y))
             except Exception:
                 pass
-    layer.triggerRepaint()
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return (math.floor(x / self.tol), math.floor(y / self.tol))
+
+    def find(self, pic: Optional[str], lat: Optional[float], lon: Optional[float],
+             expected_side: str = "") -> Optional[int]:
+        key = (pic or "").strip().lower()
+        if key:
+            fid = self.by_jpg.get((expected_side, key))
+            if fid is not None:
+                return fid
+        if lat is None or lon is None:
+            return None
+        tol = self.tol
+        cx, cy = self._cell(lon, lat)
+        best = None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for fid, x, y in self.by_cell.get((expected_side, cx + dx, cy + dy), ()):
+                    if abs(x - lon) <= tol and abs(y - lat) <= tol and (best is None or fid < best):
+                        best = fid
+        return best
 
 # 画像名 or 座標（±tol）で候補を検索（expected_side: "front"/"back"/None）
 # まず画像名があればそれを優先。なければ座標で探す。
+# lookup（PointLookup）があれば索引を引き、見つからない/古い場合だけ走査する。
 def find_feature_by_pic_or_coord(
     layer,
     pic: Optional[str],
@@ -264,32 +405,39 @@ def find_feature_by_pic_or_coord(
     lon: Optional[float],
     *,
     expected_side: Optional[str] = None,
-    tol: float = 1e-7
+    tol: float = 1e-7,
+    lookup: Optional[PointLookup] = None,
 ):
     if not layer:
         return None
-    fcache = FieldCache(layer)
     exp = (expected_side or "").strip().lower()
 
-    # 画像名で検索
+    if lookup is not None and lookup.tol == tol:
+        fid = lookup.find(pic, lat, lon, exp)
+        if fid is not None:
+            f = layer.getFeature(fid)
+            if f.isValid():
+                return f
+
+    fcache = FieldCache(layer)
+
+    # 画像名で検索（比較は QGIS 側の式評価に任せ、一致した1件だけ受け取る）
     key = (pic or "").strip().lower()
     if key and fcache.jpg >= 0:
-        req = QgsFeatureRequest()
-        # 線形走査（まずは等価移設）。後で属性インデックス or selectByExpression に差し替え可
+        expr = f"lower(trim({QgsExpression.quotedColumnRef(FN.JPG)})) = {QgsExpression.quotedString(key)}"
+        if fcache.side >= 0 and exp:
+            expr += f" AND lower(trim(\"side\")) = {QgsExpression.quotedString(exp)}"
+        req = QgsFeatureRequest().setFilterExpression(expr)
+        req.setLimit(1)
         for f in layer.getFeatures(req):
-            try:
-                if fcache.side >= 0 and exp and str(f[fcache.side]).strip().lower() != exp:
-                    continue
-                jpg = (str(f[fcache.jpg]) or "").strip().lower()
-                if jpg == key:
-                    return f
-            except Exception:
-                pass
+            return f
 
-    # 座標で検索
+    # 座標で検索（±tol の矩形で空間インデックスから候補を絞る）
     if lat is not None and lon is not None:
-        # 後で SpatialIndex に置き換え可能な形（まずは全走査）
-        for f in layer.getFeatures():
+        req = QgsFeatureRequest().setFilterRect(
+            QgsRectangle(lon - tol, lat - tol, lon + tol, lat + tol)
+        )
+        for f in layer.getFeatures(req):
             try:
                 if fcache.side >= 0 and exp and str(f[fcache.side]).strip().lower() != exp:
                     continue
@@ -302,12 +450,8 @@ def find_feature_by_pic_or_coord(
     return None
 
 def ensure_count_field(layer):
-    from qgis.PyQt.QtCore import QVariant
-    from qgis.core import QgsField
-
     if layer.fields().indexFromName("count_same") < 0:
-        layer.dataProvider().addAttributes([QgsField("count_same", QVariant.Int)])
-        layer.updateFields()
+        add_fields(layer, [QgsField("count_same", QVariant.Int)])
 
 def update_same_point_counts(layer, tol=1e-7):
     if not layer or not layer.isValid():
@@ -315,25 +459,30 @@ def update_same_point_counts(layer, tol=1e-7):
 
     ensure_count_field(layer)
 
-    groups = {}
-    feats = list(layer.getFeatures())
+    idx = layer.fields().indexFromName("count_same")
+    if idx < 0:
+        return
 
-    for f in feats:
+    # 座標と count_same だけを読み、値が変わる点だけをまとめて書く
+    req = QgsFeatureRequest().setSubsetOfAttributes([idx])
+    groups = {}
+    current = {}
+    for f in layer.getFeatures(req):
         try:
             p = f.geometry().asPoint()
             key = (round(p.x() / tol), round(p.y() / tol))
             groups.setdefault(key, []).append(f.id())
+            current[f.id()] = f[idx]
         except Exception:
             pass
 
-    idx = layer.fields().indexFromName("count_same")
-    if idx < 0:
-        return
+    changes: Dict[int, Dict[int, int]] = {}
+    for ids in groups.values():
+        n = len(ids)
+        for fid in ids:
+            if current.get(fid) != n:
+                changes[fid] = {idx: n}
 
-    with EditContext(layer):
-        for ids in groups.values():
-            n = len(ids)
-            for fid in ids:
-                layer.changeAttributeValue(fid, idx, n)
-
-    layer.triggerRepaint()
+    if changes:
+        _write_attr_changes(layer, changes)
+        layer.triggerRepaint()
@@ -1,10 +1,12 @@
 #maptool.py
+import math
 import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple, Type
+from typing import Dict, Optional, Tuple, Type
 
 from qgis.gui import QgsMapTool, QgsMapCanvas
-from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtCore import Qt, QTimer, QVariant
 from qgis.PyQt.QtWidgets import QMessageBox
 try:
     from qgis.PyQt.QtGui import QCursor, QPixmap
@@ -12,10 +14,11 @@ except Exception:
     QCursor = None
     QPixmap = None
 
-from qgis.core import (QgsCoordinateTransform, QgsProject, QgsGeometry, QgsPointXY, QgsFeature)
+from qgis.core import (QgsGeometry, QgsPointXY, QgsFeature, QgsFeatureRequest, QgsRectangle,
+                       QgsFeatureSink, QgsField, QgsSpatialIndexKDBush)
 
-from .utils import EditContext
-from .fields import FN, apply_schema, normalize_category, clear_unrelated_category_attrs
+from .utils import EditContext, get_transform
+from .fields import FN, apply_schema, add_fields, normalize_category, clear_unrelated_category_attrs
 from . import layers as lyrmod
 
 
@@ -50,25 +53,111 @@ _ASPECT_KEEP = _qt_enum(Qt, "AspectRatioMode.KeepAspectRatio", "KeepAspectRatio"
 _TRANSFORM_SMOOTH = _qt_enum(Qt, "TransformationMode.SmoothTransformation", "SmoothTransformation")
 
 
-class AddPointTool(QgsMapTool):
+# apply_schema が保証する PhotoClicks の基本フィールド
+_CLICK_SCHEMA_FIELDS = (FN.CATEGORY, FN.LAT, FN.LON, FN.JPG, "subcat")
+
+
+def _identity(pt):
+    return pt
+
+
+def _rect_request(x: float, y: float, tol: float) -> QgsFeatureRequest:
+    """(x, y) ±tol の矩形に入る地物だけを取る要求（プロバイダの空間インデックスを使う）"""
+    req = QgsFeatureRequest().setFilterRect(QgsRectangle(x - tol, y - tol, x + tol, y + tol))
+    req.setFlags(QgsFeatureRequest.ExactIntersect)
+    return req
+
+
+class _RepaintDebounce:
+    """追加・削除のたびの triggerRepaint を REPAINT_DELAY_MS ごとに1回へまとめる"""
+    REPAINT_DELAY_MS = 100
+
+    def _init_repaint_timer(self):
+        self._repaint_timer = QTimer(self)
+        self._repaint_timer.setSingleShot(True)
+        self._repaint_timer.setInterval(self.REPAINT_DELAY_MS)
+        self._repaint_timer.timeout.connect(self._do_repaint)
+
+    def _schedule_repaint(self):
+        self._repaint_timer.start()
+
+    def _do_repaint(self):
+        try:
+            if self.target and self.target.isValid():
+                self.target.triggerRepaint()
+        except RuntimeError:
+            pass  # レイヤが既に削除されている
+
+    def deactivate(self):
+        # モード解除時に保留中の再描画を出し切る
+        if self._repaint_timer.isActive():
+            self._repaint_timer.stop()
+            self._do_repaint()
+        super().deactivate()
+
+
+class AddPointTool(_RepaintDebounce, QgsMapTool):
     def __init__(self, owner, canvas, target_layer):
         super().__init__(canvas)
         self.owner = owner
         self.canvas = canvas
         self.target = target_layer
+        self._init_repaint_timer()
+
+        # フィールド名 → index はスキーマが変わったときだけ作り直す
+        # （updatedFields はツールが有効な間だけ接続する）
+        self._field_idx = None
+        self._feat_template = None
+        self._fields_hooked = False
 
         if QCursor:
             self.setCursor(QCursor(_CURSOR_CROSS))
         else:
             self.setCursor(_CURSOR_CROSS)
 
+    def _hook_field_signal(self, on: bool):
+        if on == self._fields_hooked:
+            return
+        self._fields_hooked = on
+        try:
+            if on:
+                self.target.updatedFields.connect(self._invalidate_field_names)
+            else:
+                self.target.updatedFields.disconnect(self._invalidate_field_names)
+        except (AttributeError, RuntimeError, TypeError):
+            pass  # レイヤが既に削除されている等
+
+    def activate(self):
+        super().activate()
+        self._invalidate_field_names()
+        self._hook_field_signal(True)
+
+    def deactivate(self):
+        self._hook_field_signal(False)
+        super().deactivate()
+
+    def _invalidate_field_names(self, *args):
+        self._field_idx = None
+        self._feat_template = None
+
+    def _field_indexes(self) -> Dict[str, int]:
+        if self._field_idx is None:
+            self._field_idx = {name: i for i, name in enumerate(self.target.fields().names())}
+        return self._field_idx
+
+    def _new_feature(self) -> QgsFeature:
+        # fields を持たせた雛形を 1 つ作っておき、以降はコピーで済ませる
+        if self._feat_template is None:
+            self._feat_template = QgsFeature(self.target.fields())
+        return QgsFeature(self._feat_template)
+
     def _has_same_coord_feature(self, pt_layer) -> bool:
         tol = getattr(self.owner, "COORD_TOL", 1e-7)
         x = float(pt_layer.x())
         y = float(pt_layer.y())
 
         try:
-            for f in self.target.getFeatures():
+            for f in self.target.getFeatures(_rect_request(x, y, tol)):
                 try:
                     g = f.geometry()
                     if not g:
@@ -82,13 +171,52 @@ class AddPointTool(QgsMapTool):
             pass
         return False
 
+    def _add_features(self, feats) -> None:
+        """
+        編集中でないメモリレイヤはプロバイダへ直接まとめて書く（編集バッファ・コミットを経由しない）
+        それ以外（GPKG/SHP 等の既存レイヤ、ユーザーが編集中のレイヤ）は編集セッション経由で追加する
+        - 編集中なら編集バッファに積むだけ（コミットはユーザーに任せる）
+        - 編集中でなければここで開始してコミットし、失敗したらロールバックする
+        """
+        layer = self.target
+        prov = layer.dataProvider()
+        if not layer.isEditable() and prov.name() == "memory":
+            # 戻りの fid は使わないので FastInsert で id の書き戻しを省く
+            ok, _ = prov.addFeatures(feats, QgsFeatureSink.FastInsert)
+            if not ok:
+                raise Exception("addFeatures failed.")
+            layer.updateExtents()
+            return
+
+        if layer.isEditable():
+            if not layer.addFeatures(feats):
+                raise Exception("addFeatures failed.")
+            return
+
+        layer.startEditing()
+        try:
+            if not layer.addFeatures(feats):
+                raise Exception("addFeatures failed.")
+            if not layer.commitChanges():
+                raise Exception("; ".join(layer.commitErrors()) or "commitChanges failed.")
+        except Exception:
+            try:
+                layer.rollBack()
+            except Exception:
+                pass
+            raise
+
     def canvasReleaseEvent(self, event):
         if not self.target or not self.target.isValid():
             QMessageBox.warning(self.canvas, "PhotoClicks", "Target layer is invalid")
             return
 
         try:
-            apply_schema(self.target, getattr(self.owner, "other_candidates", []))
+            # 必要フィールドが揃っていればスキーマ確認（EditContext 含む）を丸ごと省く
+            extra_fields = getattr(self.owner, "other_candidates", [])
+            fidx = self._field_indexes()
+            if not all(k in fidx for k in (*_CLICK_SCHEMA_FIELDS, *(n for n in extra_fields if n))):
+                apply_schema(self.target, extra_fields)
         except Exception as e:
             QMessageBox.warning(self.canvas, "PhotoClicks", f"Failed to apply schema: {e}")
             return
@@ -96,8 +224,10 @@ class AddPointTool(QgsMapTool):
         try:
             map_crs = self.canvas.mapSettings().destinationCrs()
             layer_crs = self.target.crs()
-            xform = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
-            pt_layer = xform.transform(event.mapPoint())
+            if map_crs == layer_crs:
+                pt_layer = QgsPointXY(event.mapPoint())
+            else:
+                pt_layer = get_transform(map_crs, layer_crs).transform(event.mapPoint())
         except Exception as e:
             QMessageBox.warning(self.canvas, "PhotoClicks", f"Coordinate transformation failed: {e}")
             return
@@ -120,37 +250,23 @@ class AddPointTool(QgsMapTool):
             pass
 
         try:
-            if not self.target.isEditable():
-                self.target.startEditing()
-
+            new_feats = []
             for extra_attrs in extra_attrs_list:
                 if will_be_combined and not (extra_attrs.get("subcat") or extra_attrs.get("subCategory")):
                     extra_attrs["subcat"] = "combined"
 
-                names_now = set(self.target.fields().names())
-                need = [k for k in extra_attrs.keys() if k not in names_now]
+                need = [k for k in extra_attrs if k not in self._field_indexes()] if extra_attrs else None
                 if need:
-                    with EditContext(self.target):
-                        from qgis.PyQt.QtCore import QVariant
-                        from qgis.core import QgsField
-                        self.target.dataProvider().addAttributes([QgsField(k, QVariant.String) for k in need])
-                        self.target.updateFields()
+                    add_fields(self.target, [QgsField(k, QVariant.String) for k in need])
+                    self._invalidate_field_names()
 
-                f = QgsFeature(self.target.fields())
+                fidx = self._field_indexes()
+                f = self._new_feature()
                 f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(pt_layer.x(), pt_layer.y())))
 
-                ilat = self.target.fields().indexFromName(FN.LAT)
-                ilon = self.target.fields().indexFromName(FN.LON)
-                ijpg = self.target.fields().indexFromName(FN.JPG)
-                if ilat >= 0:
-                    f.setAttribute(ilat, float(pt_layer.y()))
-                if ilon >= 0:
-                    f.setAttribute(ilon, float(pt_layer.x()))
-                if ijpg >= 0:
-                    f.setAttribute(ijpg, jpg_val)
-
-                for k, v in extra_attrs.items():
-                    idx = self.target.fields().indexFromName(k)
+                base = ((FN.LAT, float(pt_layer.y())), (FN.LON, float(pt_layer.x())), (FN.JPG, jpg_val))
+                for k, v in (*base, *extra_attrs.items()):
+                    idx = fidx.get(k, -1)
                     if idx >= 0:
                         f.setAttribute(idx, v)
 
@@ -163,23 +279,30 @@ class AddPointTool(QgsMapTool):
                     getattr(self.owner, "group_keep", {}),
                     getattr(self.owner, "other_candidates", []),
                 )
+                new_feats.append(f)
 
-                if not self.target.addFeatures([f]):
-                    raise Exception("addFeatures failed.")
-
-            self.target.commitChanges()
+            if new_feats:
+                self._add_features(new_feats)
             lyrmod.update_same_point_counts(self.target)
-            self.target.triggerRepaint()
+            self._schedule_repaint()
 
         except Exception as e:
-            try:
-                self.target.rollBack()
-            except Exception:
-                pass
             QMessageBox.critical(self.canvas, "PhotoClicks", f"Error while adding point(s): {e}")
 
 
-class EditPointTool(QgsMapTool):
+@lru_cache(maxsize=1)
+def _edit_cursor_pixmap():
+    """編集モードのカーソル画像（存在確認・読込・縮小はセッション中1回だけ）"""
+    cursor_path = Path(__file__).parent / "icons" / "editmode_cursor.png"
+    if not QPixmap or not cursor_path.exists():
+        return None
+    pm = QPixmap(str(cursor_path))
+    if pm.isNull():
+        return None
+    return pm.scaled(24, 24, _ASPECT_KEEP, _TRANSFORM_SMOOTH)
+
+
+class EditPointTool(_RepaintDebounce, QgsMapTool):
     TOL_PIXELS = 10
 
     def __init__(self, owner, canvas, target_layer):
@@ -187,6 +310,7 @@ class EditPointTool(QgsMapTool):
         self.owner = owner
         self.canvas = canvas
         self.target = target_layer
+        self._init_repaint_timer()
 
         self._press_pt_map = None
         self._drag_fid = None
@@ -196,15 +320,16 @@ class EditPointTool(QgsMapTool):
         self._drag_start_layer_pt = None
         self._drag_start_fid = None
 
-        cursor_path = Path(__file__).parent / "icons" / "editmode_cursor.png"
+        # 近傍検索用の KD-tree（点レイヤ専用）。地物が変わったら捨てて次回作り直す
+        # レイヤのシグナルはツールが有効な間だけ接続する（activate/deactivate）
+        self._kdbush = None
+        self._index_hooked = False
+
         try:
-            if QPixmap and cursor_path.exists():
-                pm = QPixmap(str(cursor_path))
-                if not pm.isNull():
-                    pm = pm.scaled(24, 24, _ASPECT_KEEP, _TRANSFORM_SMOOTH)
-                    if QCursor:
-                        self.setCursor(QCursor(pm, 0, 0))
-                        return
+            pm = _edit_cursor_pixmap()
+            if pm is not None and QCursor:
+                self.setCursor(QCursor(pm, 0, 0))
+                return
         except Exception:
             pass
 
@@ -219,7 +344,7 @@ class EditPointTool(QgsMapTool):
         y = float(pt_layer.y())
         hits = []
         try:
-            for f in self.target.getFeatures():
+            for f in self.target.getFeatures(_rect_request(x, y, tol)):
                 if f.id() == fid:
                     continue
                 try:
@@ -232,6 +357,43 @@ class EditPointTool(QgsMapTool):
             pass
         return hits
 
+    _INDEX_SIGNALS = ("featureAdded", "featureDeleted", "geometryChanged", "dataChanged")
+
+    def _hook_index_signals(self, on: bool):
+        if on == self._index_hooked:
+            return
+        self._index_hooked = on
+        for sig in self._INDEX_SIGNALS:
+            try:
+                signal = getattr(self.target, sig)
+                if on:
+                    signal.connect(self._invalidate_index)
+                else:
+                    signal.disconnect(self._invalidate_index)
+            except (AttributeError, RuntimeError, TypeError):
+                pass  # レイヤが既に削除されている等
+
+    def activate(self):
+        super().activate()
+        # 無効だった間の変更は追えていないので索引は作り直す
+        self._invalidate_index()
+        self._hook_index_signals(True)
+
+    def deactivate(self):
+        self._hook_index_signals(False)
+        super().deactivate()
+
+    def _invalidate_index(self, *args):
+        self._kdbush = None
+
+    def _point_index(self):
+        if self._kdbush is None:
+            try:
+                self._kdbush = QgsSpatialIndexKDBush(self.target)
+            except Exception:
+                self._kdbush = None
+        return self._kdbush
+
     def _nearest_feature(self, pt_map):
         if not self.target or not self.target.isValid():
             return None, None
@@ -239,36 +401,87 @@ class EditPointTool(QgsMapTool):
         mpp = self.canvas.mapSettings().mapUnitsPerPixel()
         tol_map = mpp * self.TOL_PIXELS
 
-        layer_to_map = QgsCoordinateTransform(
-            self.target.crs(),
-            self.canvas.mapSettings().destinationCrs(),
-            QgsProject.instance()
-        )
+        # レイヤ→地図の座標変換（同じCRSなら変換しない）
+        layer_crs = self.target.crs()
+        map_crs = self.canvas.mapSettings().destinationCrs()
+        layer_to_map = _identity if layer_crs == map_crs else get_transform(layer_crs, map_crs).transform
 
-        pt_geom_map = QgsGeometry.fromPointXY(QgsPointXY(pt_map.x(), pt_map.y()))
+        index = self._point_index()
+        if index is not None:
+            try:
+                return self._nearest_by_index(index, pt_map, tol_map, layer_to_map)
+            except Exception:
+                pass
 
-        nearest_f = None
-        nearest_dist = None
-        for f in self.target.getFeatures():
+        # 索引が使えない場合も、許容範囲の矩形で候補を絞ってから距離を測る
+        try:
+            center, radius = self._search_radius_in_layer(pt_map, tol_map)
+            req = _rect_request(center.x(), center.y(), radius)
+        except Exception:
+            req = QgsFeatureRequest()
+        req.setSubsetOfAttributes([])
+
+        # 点レイヤなのでジオメトリは複製せず座標だけ変換し、最寄りは fid と距離の2乗で持つ
+        x0, y0 = pt_map.x(), pt_map.y()
+        nearest_fid = None
+        nearest_d2 = None
+        for f in self.target.getFeatures(req):
             try:
-                geom_map = QgsGeometry(f.geometry())
-                geom_map.transform(layer_to_map)
-                d = pt_geom_map.distance(geom_map)
-                if nearest_dist is None or d < nearest_dist:
-                    nearest_dist = d
-                    nearest_f = f
+                p = layer_to_map(f.geometry().asPoint())
+                dx = p.x() - x0
+                dy = p.y() - y0
+                d2 = dx * dx + dy * dy
+                if nearest_d2 is None or d2 < nearest_d2:
+                    nearest_d2 = d2
+                    nearest_fid = f.id()
             except Exception:
                 pass
+        return self._feature_within(nearest_fid, nearest_d2, tol_map)
 
-        if nearest_f is None or nearest_dist is None or nearest_dist > tol_map:
+    def _feature_within(self, fid, d2, tol_map):
+        """距離の2乗 d2 が許容範囲内なら地物と距離を返す（平方根はここで1回だけ取る）"""
+        if fid is None or d2 is None or d2 > tol_map * tol_map:
             return None, None
-        return nearest_f, nearest_dist
+        f = self.target.getFeature(fid)
+        if not f.isValid():
+            return None, None
+        return f, math.sqrt(d2)
+
+    def _search_radius_in_layer(self, pt_map, tol_map):
+        """クリック位置と許容距離（地図単位）をレイヤCRSに写す（半径は少し広めに取る）"""
+        pt_layer = self._map_to_layer_point(pt_map)
+        if self.target.crs() == self.canvas.mapSettings().destinationCrs():
+            return QgsPointXY(pt_layer.x(), pt_layer.y()), tol_map * 1.5
+        tol_layer = 0.0
+        for dx, dy in ((tol_map, 0.0), (0.0, tol_map)):
+            edge = self._map_to_layer_point(QgsPointXY(pt_map.x() + dx, pt_map.y() + dy))
+            tol_layer = max(tol_layer, abs(edge.x() - pt_layer.x()), abs(edge.y() - pt_layer.y()))
+        return QgsPointXY(pt_layer.x(), pt_layer.y()), tol_layer * 1.5
+
+    def _nearest_by_index(self, index, pt_map, tol_map, layer_to_map):
+        # 候補はレイヤCRSで取り出し、最終的な距離判定は従来どおり地図CRSで行う
+        center, radius = self._search_radius_in_layer(pt_map, tol_map)
+
+        x0, y0 = pt_map.x(), pt_map.y()
+        nearest_fid = None
+        nearest_d2 = None
+        for d in index.within(center, radius):
+            p = layer_to_map(d.point())
+            dx = p.x() - x0
+            dy = p.y() - y0
+            d2 = dx * dx + dy * dy
+            if nearest_d2 is None or d2 < nearest_d2:
+                nearest_d2 = d2
+                nearest_fid = d.id
+
+        return self._feature_within(nearest_fid, nearest_d2, tol_map)
 
     def _map_to_layer_point(self, pt_map):
         map_crs = self.canvas.mapSettings().destinationCrs()
         layer_crs = self.target.crs()
-        xform = QgsCoordinateTransform(map_crs, layer_crs, QgsProject.instance())
-        return xform.transform(pt_map)
+        if map_crs == layer_crs:
+            return QgsPointXY(pt_map)
+        return get_transform(map_crs, layer_crs).transform(pt_map)
 
     def canvasMoveEvent(self, event):
         if self._drag_fid is None or self._press_pt_map is None:
@@ -371,8 +584,9 @@ class EditPointTool(QgsMapTool):
         with EditContext(self.target):
             if not self.target.dataProvider().deleteFeatures([feat.id()]):
                 raise Exception("deleteFeatures failed")
+        self._invalidate_index()
         lyrmod.update_same_point_counts(self.target)
-        self.target.triggerRepaint()
+        self._schedule_repaint()
 
     def _prompt_single_attrs_for_edit(self) -> Optional[dict]:
         while True:
@@ -477,7 +691,7 @@ class EditPointTool(QgsMapTool):
                 pass
 
             lyrmod.update_same_point_counts(self.target)
-            self.target.triggerRepaint()
+            self._schedule_repaint()
 
             self._drag_fid = None
             self._drag_fids = None
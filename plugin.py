@@ -12,6 +12,7 @@ from qgis.PyQt.QtCore import Qt
 
 from .utils import settings, SKEY_GEOM
 from .viewer import PhotoViewerPlus
+from . import images
 
 class QGISToolPlugin:
     def __init__(self, iface_):
@@ -61,6 +62,8 @@ class QGISToolPlugin:
             except Exception:
                 pass
         self.viewer = None
+        # デコード済み画像のキャッシュを手放す（モジュールはアンロード後も残るため）
+        images.clear_cache()
 
     def run(self):
         # 既にあれば再表示
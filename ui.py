@@ -1,5 +1,5 @@
 # ui.py
-from qgis.PyQt.QtCore import Qt, pyqtSignal, QEvent
+from qgis.PyQt.QtCore import Qt, pyqtSignal, QEvent, QTimer
 from qgis.PyQt.QtGui import QKeySequence
 from qgis.PyQt.QtWidgets import (
     QDockWidget, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QPushButton,
@@ -41,6 +41,19 @@ def _ensure_singleton_dock(iface, object_name: str):
             w.deleteLater()
 
 
+class _ImageLabel(QLabel):
+    """写真表示用ラベル（ダブルクリック/リサイズをシグナルで通知する）"""
+    doubleClicked = pyqtSignal()
+    resized = pyqtSignal()
+
+    def mouseDoubleClickEvent(self, ev):
+        self.doubleClicked.emit()
+
+    def resizeEvent(self, ev):
+        super().resizeEvent(ev)
+        self.resized.emit()
+
+
 class PhotoViewerDock(QDockWidget):
     prevRequested = pyqtSignal()
     nextRequested = pyqtSignal()
@@ -55,8 +68,10 @@ class PhotoViewerDock(QDockWidget):
     categoryMasterRequested = pyqtSignal()
 
     imageDoubleClicked = pyqtSignal(str)
+    imageResized = pyqtSignal(str)  # リサイズが落ち着いた側（"front"/"back"）
 
     OBJECT_NAME = "PhotoViewerDockPlus"
+    RESIZE_SETTLE_MS = 150
 
     def __init__(self, iface, auto_zoom_default: bool = True, parent=None):
         super().__init__("PhotoViewer", parent or iface.mainWindow())
@@ -91,6 +106,9 @@ class PhotoViewerDock(QDockWidget):
         self._SMOOTH_TRANSFORM = _qt_enum(
             Qt, "TransformationMode.SmoothTransformation", "SmoothTransformation"
         )
+        self._FAST_TRANSFORM = _qt_enum(
+            Qt, "TransformationMode.FastTransformation", "FastTransformation"
+        )
 
         self._SIZEPOLICY_EXPANDING = _qt_enum(
             QSizePolicy, "Policy.Expanding", "Expanding"
@@ -122,8 +140,22 @@ class PhotoViewerDock(QDockWidget):
         layout_root.setContentsMargins(6, 6, 6, 6)
         layout_root.setSpacing(4)
 
-        self.img_label_front = QLabel("⚙ Select CSV and image folder to start")
-        self.img_label_back = QLabel("⚙ Select CSV and image folder to start")
+        self._painted_keys = {"front": None, "back": None}
+        self._pending_keys = {"front": None, "back": None}
+        # ラベルに貼る前の元画像（リサイズ時はここから縮小し直す）
+        self._source_pix = {"front": None, "back": None}
+        # 直近の滑らか縮小結果 (元画像の cacheKey, 幅, 縮小画像)。同じ幅なら縮小し直さない
+        self._scaled_memo = {"front": None, "back": None}
+        # リサイズ中は粗い縮小で追従し、止まってから滑らかに描き直す（表/裏で別タイマ）
+        self._resize_timers = {}
+        for side in ("front", "back"):
+            t = QTimer(self)
+            t.setSingleShot(True)
+            t.setInterval(self.RESIZE_SETTLE_MS)
+            t.timeout.connect(lambda side=side: self._on_resize_settled(side))
+            self._resize_timers[side] = t
+        self.img_label_front = _ImageLabel("⚙ Select CSV and image folder to start")
+        self.img_label_back = _ImageLabel("⚙ Select CSV and image folder to start")
 
         for lab in (self.img_label_front, self.img_label_back):
             lab.setAlignment(self._ALIGN_CENTER)
@@ -132,13 +164,9 @@ class PhotoViewerDock(QDockWidget):
             lab.setSizePolicy(self._SIZEPOLICY_EXPANDING, self._SIZEPOLICY_EXPANDING)
             lab.setStyleSheet("border: 1px solid #999; background-color:#fdfdfd;")
 
-        def _mk_dblclick(side: str):
-            def _handler(ev):
-                self.imageDoubleClicked.emit(side)
-            return _handler
-
-        self.img_label_front.mouseDoubleClickEvent = _mk_dblclick("front")
-        self.img_label_back.mouseDoubleClickEvent = _mk_dblclick("back")
+        for side, lab in (("front", self.img_label_front), ("back", self.img_label_back)):
+            lab.doubleClicked.connect(lambda side=side: self.imageDoubleClicked.emit(side))
+            lab.resized.connect(lambda side=side: self._on_label_resized(side))
 
         self.inline_name_front = QLabel()
         self.inline_name_back = QLabel()
@@ -330,34 +358,73 @@ class PhotoViewerDock(QDockWidget):
     def setAutoZoomChecked(self, checked: bool):
         self.zoom_chk.setChecked(bool(checked))
 
+    def painted_key(self, side: str):
+        """いま表示中の画像のキー（メッセージ表示中は None）"""
+        return self._painted_keys.get(side)
+
+    def pending_key(self, side: str):
+        """デコード待ちの画像のキー（別の表示に切り替わったら None）"""
+        return self._pending_keys.get(side)
+
+    def set_pending(self, side: str, key):
+        """デコード完了まで今の表示を残し、待っている画像のキーだけ覚えておく"""
+        self._pending_keys[side] = key
+
+    def image_width(self, side: str) -> int:
+        lab = self.img_label_front if side == "front" else self.img_label_back
+        return max(1, lab.width())
+
     def set_message(self, side: str, text: str):
         lab = self.img_label_front if side == "front" else self.img_label_back
+        self._painted_keys[side] = None
+        self._pending_keys[side] = None
+        self._source_pix[side] = None
+        self._scaled_memo[side] = None
         lab.clear()
         lab.setText(text or "")
 
-    def set_pixmap(self, side: str, pm):
+    def set_pixmap(self, side: str, pm, key=None):
         lab = self.img_label_front if side == "front" else self.img_label_back
+        self._pending_keys[side] = None
         if pm is None or pm.isNull():
+            self._painted_keys[side] = None
+            self._source_pix[side] = None
+            self._scaled_memo[side] = None
             lab.clear()
             return
+        self._painted_keys[side] = key
+        self._source_pix[side] = pm
 
-        lab.setPixmap(
-            pm.scaledToWidth(max(1, lab.width()), self._SMOOTH_TRANSFORM)
-        )
-
-        if not hasattr(lab, "_pv_orig_resizeEvent"):
-            lab._pv_orig_resizeEvent = lab.resizeEvent
+        lab.setPixmap(self._smooth_scaled(side, pm, max(1, lab.width())))
 
-        def _resize(ev):
-            cur = lab.pixmap()
-            if cur and not cur.isNull():
-                lab.setPixmap(
-                    cur.scaledToWidth(max(1, lab.width()), self._SMOOTH_TRANSFORM)
-                )
-            if getattr(lab, "_pv_orig_resizeEvent", None):
-                lab._pv_orig_resizeEvent(ev)
-
-        lab.resizeEvent = _resize
+    def _on_label_resized(self, side: str):
+        lab = self.img_label_front if side == "front" else self.img_label_back
+        src = self._source_pix.get(side)
+        if src is None or src.isNull():
+            return
+        pix = lab.pixmap()
+        # 高さだけの変化など、表示中の画像と幅が同じなら縮小し直さない
+        if pix is not None and not pix.isNull() and pix.width() == max(1, lab.width()):
+            return
+        lab.setPixmap(src.scaledToWidth(max(1, lab.width()), self._FAST_TRANSFORM))
+        self._resize_timers[side].start()
+
+    def _smooth_scaled(self, side: str, src, w: int):
+        memo = self._scaled_memo.get(side)
+        ck = src.cacheKey()
+        if memo is not None and memo[0] == ck and memo[1] == w:
+            return memo[2]
+        scaled = src.scaledToWidth(w, self._SMOOTH_TRANSFORM)
+        self._scaled_memo[side] = (ck, w, scaled)
+        return scaled
+
+    def _on_resize_settled(self, side: str):
+        lab = self.img_label_front if side == "front" else self.img_label_back
+        src = self._source_pix.get(side)
+        if src is None or src.isNull():
+            return
+        lab.setPixmap(self._smooth_scaled(side, src, max(1, lab.width())))
+        self.imageResized.emit(side)
 
 
 def create_dock(auto_zoom_default: bool = True, iface=_iface) -> PhotoViewerDock:
@@ -1,13 +1,20 @@
 #utils.py
 import csv
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Dict, List
 
 from qgis.PyQt.QtCore import QSettings
 from qgis.core import (
-    QgsVectorFileWriter, QgsCoordinateReferenceSystem,
-    QgsProject, QgsCoordinateTransform,)
+    QgsVectorFileWriter, QgsVectorFileWriterTask, QgsCoordinateReferenceSystem,
+    QgsProject, QgsCoordinateTransform, QgsPointXY,)
+
+try:
+    # 崩れたCSVの判定に強い（無ければ区切り文字の出現数で判定）
+    from clevercsv import Sniffer as CCSniffer
+except ImportError:
+    CCSniffer = None
 
 SKEY_ROOT = "QGISTool/"
 SKEY_CSV  = SKEY_ROOT + "last_csv"
@@ -33,12 +40,25 @@ class Row:
     lat_back: Optional[float]
     lon_back: Optional[float]
     course_back: Optional[float]
+    # 検索用キー（小文字化済み）。CSV読込時に1回だけ計算する
+    kp_key: str = field(default="", init=False, repr=False, compare=False)
+    front_key: str = field(default="", init=False, repr=False, compare=False)
+    back_key: str = field(default="", init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.kp_key = lookup_key(self.kp)
+        self.front_key = lookup_key(self.front)
+        self.back_key = lookup_key(self.back)
+
+def lookup_key(value) -> str:
+    """KP/画像名の検索キー（索引作成時と検索時で同じ正規化を使う）"""
+    return str(value or "").strip().lower()
 
 def _same_street_row(r1: Optional[Row], r2: Optional[Row]) -> bool:
     """同じstreetか（None安全）"""
     return (
         r1 is not None and r2 is not None and
-        (getattr(r1, "street", "") or "") == (getattr(r2, "street", "") or "")
+        (r1.street or "") == (r2.street or "")
     )
 
 def neighbor_rows(rows: List[Row], pos: int) -> tuple[Optional[Row], Optional[Row]]:
@@ -72,22 +92,26 @@ def resolve_display_images(rows: List[Row], pos: int) -> tuple[Optional[str], Op
 
     return disp_front, disp_back
 
+# BOM・ゼロ幅文字は消し、各種の空白は半角スペースにそろえる
+_HEADER_TRANS = str.maketrans({
+    "\ufeff": None, "\u200b": None, "\u200d": None,
+    "\u00a0": " ", "\u202f": " ", "\u3000": " ",
+})
+
 def normalize_header(h: str) -> str:
     if h is None:
         return ""
-    s = h
-    for a, b in [
-        ("\ufeff", ""), ("\u200b", ""), ("\u200d", ""),
-        ("\u00a0", " "), ("\u202f", " "), ("\u3000", " "),
-    ]:
-        s = s.replace(a, b)
-    s = s.strip().lower()
+    s = h.translate(_HEADER_TRANS).strip()
     if len(s) >= 2 and ((s[0] == s[-1]) and s[0] in ("'", '"')):
         s = s[1:-1].strip()
-    return s
+    return s.lower()
 
-def header_map(fieldnames: List[str]) -> Dict[str, str]:
-    return {normalize_header(h): h for h in (fieldnames or [])}
+def header_map(fieldnames: List[str], normalized: Optional[List[str]] = None) -> Dict[str, str]:
+    """正規化済みヘッダ → 元のヘッダ名（normalized を渡せば正規化し直さない）"""
+    fieldnames = fieldnames or []
+    if normalized is None:
+        normalized = [normalize_header(h) for h in fieldnames]
+    return dict(zip(normalized, fieldnames))
 
 def parse_float(x: Optional[str]):
     s = (x or '').strip()
@@ -122,10 +146,61 @@ class EditContext:
         except Exception:
             pass
 
-def export_layer_to_csv(layer, out_csv_path: str, only_selected: bool = False):
-    if not layer or not layer.isValid():
-        raise Exception("Layer is invalid")
+@lru_cache(maxsize=None)
+def crs_from_authid(authid: str) -> QgsCoordinateReferenceSystem:
+    """authid（例: EPSG:4326）からCRSを生成（PROJ参照は初回のみ）"""
+    return QgsCoordinateReferenceSystem(authid)
+
+_xform_hooked = False
+
+@lru_cache(maxsize=64)
+def _transform_cached(src_authid: str, dst_authid: str) -> QgsCoordinateTransform:
+    return QgsCoordinateTransform(
+        crs_from_authid(src_authid), crs_from_authid(dst_authid), QgsProject.instance()
+    )
+
+_XFORM_TO_WGS84: Dict[str, QgsCoordinateTransform] = {}
+
+def _clear_transform_caches(*args):
+    _transform_cached.cache_clear()
+    _XFORM_TO_WGS84.clear()
 
+def _hook_transform_caches():
+    """プロジェクトのCRS/変換設定が変わったら、使い回している変換をすべて捨てる（接続は1回だけ）"""
+    global _xform_hooked
+    if _xform_hooked:
+        return
+    prj = QgsProject.instance()
+    for sig in (prj.crsChanged, prj.transformContextChanged):
+        try:
+            sig.connect(_clear_transform_caches)
+        except Exception:
+            pass
+    _xform_hooked = True
+
+def get_transform(src_crs, dst_crs) -> QgsCoordinateTransform:
+    """
+    src_crs -> dst_crs の変換を authid ごとに使い回す（毎クリックの PROJ 初期化を避ける）
+    プロジェクトのCRS/変換設定が変わったら捨てる。authid の無い独自CRSは毎回生成
+    """
+    src_id, dst_id = src_crs.authid(), dst_crs.authid()
+    if not src_id or not dst_id:
+        return QgsCoordinateTransform(src_crs, dst_crs, QgsProject.instance())
+    _hook_transform_caches()
+    return _transform_cached(src_id, dst_id)
+
+def _transform_to_wgs84(src_crs, ctx) -> QgsCoordinateTransform:
+    """src_crs -> EPSG:4326 の変換をauthidごとに使い回す（get_transform と同じく変換設定の変更で捨てる）"""
+    key = src_crs.authid()
+    xform = _XFORM_TO_WGS84.get(key) if key else None
+    if xform is None:
+        xform = QgsCoordinateTransform(src_crs, crs_from_authid("EPSG:4326"), ctx)
+        if key:
+            _hook_transform_caches()
+            _XFORM_TO_WGS84[key] = xform
+    return xform
+
+def _csv_export_options(layer, only_selected: bool):
     options = QgsVectorFileWriter.SaveVectorOptions()
     options.driverName = "CSV"
     options.fileEncoding = "UTF-8"
@@ -136,36 +211,76 @@ def export_layer_to_csv(layer, out_csv_path: str, only_selected: bool = False):
     ]
     options.onlySelectedFeatures = bool(only_selected)
 
-    dest_crs = QgsCoordinateReferenceSystem("EPSG:4326")
+    dest_crs = crs_from_authid("EPSG:4326")
     ctx = QgsProject.instance().transformContext()
-    options.ct = QgsCoordinateTransform(layer.crs(), dest_crs, ctx)
+    options.ct = _transform_to_wgs84(layer.crs(), ctx)
     try:
         options.destinationCrs = dest_crs
     except Exception:
         pass
+    return options, ctx
 
-    res, err = QgsVectorFileWriter.writeAsVectorFormatV2(
-        layer, out_csv_path, ctx, options
-    )
+def export_layer_to_csv(layer, out_csv_path: str, only_selected: bool = False):
+    if not layer or not layer.isValid():
+        raise Exception("Layer is invalid")
+
+    options, ctx = _csv_export_options(layer, only_selected)
+
+    # QGIS 3.20+ は V3（V2 は非推奨）。どちらも OGR の CSV ドライバで書き出す
+    write = getattr(QgsVectorFileWriter, "writeAsVectorFormatV3", None) \
+        or QgsVectorFileWriter.writeAsVectorFormatV2
+    result = write(layer, out_csv_path, ctx, options)
+    res, err = result[0], result[1]
     if res != QgsVectorFileWriter.NoError:
-        raise Exception(f"Failed to export CSV")
+        raise Exception(f"Failed to export CSV: {err}" if err else "Failed to export CSV")
+
+def export_layer_to_csv_task(layer, out_csv_path: str, only_selected: bool = False) -> QgsVectorFileWriterTask:
+    """
+    export_layer_to_csv のバックグラウンド版（QgsTask を返すだけ。登録は呼び出し側）
+    地物の読み出し元はタスク作成時にGUIスレッドで用意され、書き出しだけがワーカーで走る
+    完了は writeComplete(path)、失敗は errorOccurred(code, message) で通知される
+    """
+    if not layer or not layer.isValid():
+        raise Exception("Layer is invalid")
+    options, _ = _csv_export_options(layer, only_selected)
+    return QgsVectorFileWriterTask(layer, out_csv_path, options)
+
+_DELIMITERS = (",", "\t", ";", "|")
+_SNIFF_MAX_LINES = 20
 
-def detect_csv_dialect(file_obj, sample_size=8192):
-    """CSVの区切り文字を自動推定してcsv.Dialectを返す"""
+def detect_csv_dialect(file_obj, sample_size=2048):
+    """
+    先頭サンプルで候補の区切り文字（, タブ ; |）を1パスで数えて csv.Dialect を返す
+    （標準の Sniffer は日本語ヘッダ等で失敗することがあるので使わない。clevercsv があればそちらを優先）
+    ダブルクォート内の文字は数えない。同数なら , を優先
+    途中で切れた最終行は数えない（先頭 20 行まで）
+    """
     sample = file_obj.read(sample_size)
     file_obj.seek(0)
-    try:
-        return csv.Sniffer().sniff(sample, delimiters=[",", "\t", ";", "|"])
-    except Exception:
-        import csv as _csv
-        if "\t" in sample:
-            return _csv.excel_tab
-        elif ";" in sample and sample.count(";") > sample.count(","):
-            d = _csv.excel
-            d.delimiter = ";"
-            return d
-        else:
-            return _csv.excel
+    lines = sample.splitlines()
+    if len(lines) > 1 and not sample.endswith(("\n", "\r")):
+        lines.pop()
+    sample = "\n".join(lines[:_SNIFF_MAX_LINES])
+    if CCSniffer is not None and sample:
+        try:
+            dialect = CCSniffer().sniff(sample, delimiters="".join(_DELIMITERS))
+            if dialect is not None and dialect.delimiter in _DELIMITERS:
+                return dialect
+        except Exception:
+            pass
+    counts = dict.fromkeys(_DELIMITERS, 0)
+    in_quote = False
+    for ch in sample:
+        if ch == '"':
+            in_quote = not in_quote
+        elif not in_quote and ch in counts:
+            counts[ch] += 1
+    delim = max(_DELIMITERS, key=counts.__getitem__)
+    if counts[delim] == 0 or delim == ",":
+        return csv.excel
+    if delim == "\t":
+        return csv.excel_tab
+    return type("detected", (csv.excel,), {"delimiter": delim})
 
 def safe_float(val) -> Optional[float]:
     """文字列をfloatに変換（失敗時はNone）"""
@@ -175,37 +290,49 @@ def safe_float(val) -> Optional[float]:
         return None
 
 def safe_str(row, headers, *keys) -> str:
+    hget = headers.get
     for k in keys:
-        if k in headers:
-            try:
-                return (row[headers[k]] or "").strip()
-            except Exception:
-                pass
+        col = hget(k)
+        if col is None:
+            continue
+        try:
+            return (row[col] or "").strip()
+        except Exception:
+            pass
     return ""
 
 def transform_point(lat, lon, src_epsg="EPSG:4326", dst_crs=None):
     """QgsPointXYをdst_crsに変換（必要な場合のみ）"""
-    from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsPointXY
     pt = QgsPointXY(lon, lat)
     if not dst_crs or not dst_crs.isValid():
         return pt
-    src = QgsCoordinateReferenceSystem(src_epsg)
+    src = crs_from_authid(src_epsg)
     if dst_crs == src:
         return pt
-    transform = QgsCoordinateTransform(src, dst_crs, QgsProject.instance())
-    return transform.transform(pt)
+    return get_transform(src, dst_crs).transform(pt)
 
-def resolve_path(base_dir: Path, path_like: str) -> Path:
-    """画像などの相対パスを絶対パスに解決"""
-    p = Path(path_like or "").expanduser()
+@lru_cache(maxsize=4096)
+def _resolve_path_cached(base_dir: Path, path_like: str) -> Path:
+    p = Path(path_like).expanduser()
     return p if p.is_absolute() else base_dir / p
 
+def resolve_path(base_dir: Path, path_like: str) -> Path:
+    """画像などの相対パスを絶対パスに解決（同じ組み合わせはキャッシュ）"""
+    return _resolve_path_cached(Path(base_dir), path_like or "")
+
+def clear_resolve_path_cache() -> None:
+    """画像フォルダを切り替えたときに古い解決結果を捨てる"""
+    _resolve_path_cached.cache_clear()
+
 def get_attr_safe(feat, name, default=None):
-    """QgsFeatureの属性を安全に取得"""
+    """QgsFeatureの属性を安全に取得（存在しない列は例外を出さずにdefault）"""
     try:
-        return feat[name]
+        idx = feat.fields().indexOf(name)
     except Exception:
         return default
+    if idx < 0:
+        return default
+    return feat.attribute(idx)
     
 # streetview
 def make_streetview_url(lat: float, lon: float, heading: float = 0.0) -> str:
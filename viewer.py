@@ -1,19 +1,25 @@
 #viewer.py
+import math
+import os
 import re
+from array import array
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Dict, List, Tuple
 from datetime import datetime
 
 from qgis.PyQt.QtGui import QPixmap, QDesktopServices
-from qgis.PyQt.QtCore import Qt, QUrl, QStandardPaths
-from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox, QDialog
-from qgis.core import QgsProject, QgsRectangle
+from qgis.PyQt.QtCore import (
+    Qt, QUrl, QStandardPaths, pyqtSignal,
+)
+from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox, QDialog, QProgressDialog
+from qgis.core import QgsApplication, QgsCategorizedSymbolRenderer, QgsProject, QgsRectangle, QgsTask
 from qgis.utils import iface
 
 from .utils import (
     Row, settings, normalize_header,
     SKEY_ROOT, SKEY_CSV, SKEY_IMG, SKEY_AUTZOOM,
-    resolve_path, get_attr_safe)
+    resolve_path, get_attr_safe, lookup_key)
 from .fields import FN, build_category_runtime
 
 from . import dialogs
@@ -23,6 +29,7 @@ from . import maptools
 from . import utils
 from . import ui as ui_mod
 from . import io as io_mod
+from . import images
 
 
 def _qt_enum(container, scoped_name: str, legacy_name: str = None, default=None):
@@ -49,6 +56,91 @@ def _qt_enum(container, scoped_name: str, legacy_name: str = None, default=None)
     )
 
 
+_SUB_VAL_RE = re.compile(r"^(.*?)\s*=\s*(\d+)$")
+
+
+def _parse_sub_vals(val: str) -> List[str]:
+    """'stop=2, yield' -> ['stop', 'stop', 'yield']（個数は1〜999）"""
+    if not val:
+        return []
+    out: List[str] = []
+    for tok in val.split(","):
+        label = tok.strip().lower()
+        if not label:
+            continue
+        n = 1
+        if "=" in label:
+            m = _SUB_VAL_RE.match(label)
+            if m:
+                label = m.group(1).strip()
+                n = max(1, min(int(m.group(2)), 999))
+        if not label:
+            continue
+        out.extend([label] * n)
+    return out
+
+
+_CATEGORY_KEYS = ("category", "categories", "カテゴリ", "カテゴリー")
+
+
+@lru_cache(maxsize=256)
+def _attr_keys(name: str) -> Tuple[str, str]:
+    """属性ダイアログの項目名 → (正規化名, 書き込み先フィールド名)。lat/lon/jpg は user_ を付ける"""
+    norm = normalize_header(name)
+    return norm, (f"user_{norm}" if norm in ("lat", "lon", "jpg") else norm)
+
+
+class _CsvLoadTask(QgsTask):
+    """
+    画像CSVの読込を QGIS のタスクマネージャで行う（進捗とキャンセルはタスクマネージャのバーから）
+    結果は GUIスレッドで rowsLoaded(List[Row])、失敗・キャンセルは loadFailed(message) で通知する
+    """
+
+    rowsLoaded = pyqtSignal(object)
+    loadFailed = pyqtSignal(str)
+
+    _SAMPLE_BYTES = 1 << 16  # 行数の見積もりに使う先頭サンプル
+
+    def __init__(self, csv_path: str):
+        super().__init__(f"Loading {Path(csv_path).name}", QgsTask.CanCancel)
+        self.csv_path = csv_path
+        self.rows: Optional[List[Row]] = None
+        self.error = ""
+        self._est_rows = 0
+
+    def _estimate_rows(self) -> int:
+        # 先頭サンプルの平均行長からおおよその行数を出す（進捗率の分母。目安なので 99% で止める）
+        try:
+            size = os.path.getsize(self.csv_path)
+            with open(self.csv_path, "rb") as f:
+                sample = f.read(self._SAMPLE_BYTES)
+        except OSError:
+            return 0
+        lines = sample.count(b"\n")
+        return int(size * lines / len(sample)) if sample and lines else 0
+
+    def _tick(self, i: int):
+        if self.isCanceled():
+            raise Exception("Operation was canceled by the user")
+        if self._est_rows:
+            self.setProgress(min(99.0, i * 100.0 / self._est_rows))
+
+    def run(self) -> bool:
+        self._est_rows = self._estimate_rows()
+        try:
+            self.rows = io_mod.load_images_csv(self.csv_path, on_progress=self._tick)
+        except Exception as e:
+            self.error = str(e)
+            return False
+        return True
+
+    def finished(self, result: bool):
+        if result:
+            self.rowsLoaded.emit(self.rows)
+        else:
+            self.loadFailed.emit(self.error or "Operation was canceled by the user")
+
+
 class PhotoViewerPlus:
     LAYER_NAME = "PhotoPoints"
     CLICK_LAYER_NAME = "PhotoClicks"
@@ -61,16 +153,35 @@ class PhotoViewerPlus:
         self.layer = None
         self.click_layer = None
         self.current_index = 0
-        self.suspend_selection_signal = False
         self.COORD_TOL = 1e-7
         self.auto_zoom = bool(settings.value(SKEY_AUTZOOM, True, type=bool))
+        # キャンバス/プロジェクトはプラグイン生存中は同じなので取得は1回だけ
+        self._canvas = iface.mapCanvas()
+        self._project = QgsProject.instance()
         self._idx_by_kp: Dict[str, int] = {}
         self._idx_by_pic: Dict[str, int] = {}
+        self._idx_by_coord: Dict[Tuple[int, int], List[int]] = {}
+        # KP と画像名をまとめた検索用（KPが優先）
+        self._idx_any: Dict[str, int] = {}
+        # 座標列（列指向・欠損は NaN）。検索系はRowではなくこちらを読む
+        self._lon_f = array("d")
+        self._lat_f = array("d")
+        self._lon_b = array("d")
+        self._lat_b = array("d")
+        self._first_coord: Optional[Tuple[float, float]] = None
+        self._last_display_key = None
+        self._point_lookup = None
+        # 直前の自動ズーム (fid の組, ズーム後の表示範囲)
+        self._last_zoom = None
+        self._csv_task = None
+        self._export_task = None
         self._prev_map_tool = None
         self._click_tool = None
         self._edit_tool = None
         self.attr_specs, self.main_to_field, self.group_keep, self.other_candidates, self.category_symbols = build_category_runtime()
         self.category_master_csv = ""
+        self._prefetcher = images.PixmapPrefetcher()
+        self._prefetcher.loaded.connect(self._on_pixmap_loaded)
 
         # --- PyQt5 / PyQt6 互換ヘルパ ---------------------------------
         self._APP_MODAL = _qt_enum(
@@ -111,6 +222,7 @@ class PhotoViewerPlus:
 
         self.dock.prevRequested.connect(self.prev_image)
         self.dock.nextRequested.connect(self.next_image)
+        self.dock.imageResized.connect(self._on_image_resized)
         self.dock.configRequested.connect(self.configure_and_load)
         self.dock.categoryMasterRequested.connect(self.select_category_master)
         self.dock.gmapsRequested.connect(self._open_gmaps)
@@ -124,12 +236,10 @@ class PhotoViewerPlus:
 
     def _jump_text(self, text: str):
         self.q_edit.setText(text or "")
-        key = (text or "").strip().lower()
+        key = lookup_key(text)
         if not key:
             return
-        i = self._idx_by_kp.get(key)
-        if i is None:
-            i = self._idx_by_pic.get(key)
+        i = self._idx_any.get(key)
         if i is None:
             QMessageBox.information(iface.mainWindow(), "Jump", f"Not found: {key}")
             return
@@ -188,8 +298,8 @@ class PhotoViewerPlus:
             if self.click_layer and self.click_layer.isValid():
                 self.click_layer = lyrmod.ensure_click_layer(
                     self.CLICK_LAYER_NAME,
-                    getattr(self, "other_candidates", []),
-                    getattr(self, "category_symbols", {}),
+                    self.other_candidates,
+                    self.category_symbols,
                 )
 
             QMessageBox.information(
@@ -214,12 +324,35 @@ class PhotoViewerPlus:
         self._hook_layer(self.layer)
         return self.layer
 
+    def _click_layer_intact(self, lyr) -> bool:
+        """
+        設定済みのクリックレイヤがそのまま使えるか（プロジェクトに残っていて、
+        必要な列・カテゴリ記号・件数ラベルが外されていない）
+        """
+        if lyr is None or not lyr.isValid() or self._project.mapLayer(lyr.id()) is None:
+            return False
+        names = set(lyr.fields().names())
+        need = [FN.CATEGORY, FN.LAT, FN.LON, FN.JPG, "subcat", "count_same"]
+        if any(n and n not in names for n in need + list(self.other_candidates or [])):
+            return False
+        renderer = lyr.renderer()
+        if not isinstance(renderer, QgsCategorizedSymbolRenderer) or renderer.classAttribute() != FN.CATEGORY:
+            return False
+        return lyr.labelsEnabled()
+
     def _ensure_click_layer_or_msg(self, title: str):
+        # 設定済みのレイヤが崩れていなければそのまま使い、列やスタイルが変えられていたら
+        # ensure_click_layer で適用し直す（カテゴリマスタ読込時は select_category_master 側で適用し直す）
+        try:
+            if self._click_layer_intact(self.click_layer):
+                return self.click_layer
+        except RuntimeError:
+            self.click_layer = None
         try:
             lyr = lyrmod.ensure_click_layer(
                 self.CLICK_LAYER_NAME,
-                getattr(self, "other_candidates", []),
-                getattr(self, "category_symbols", {}),
+                self.other_candidates,
+                self.category_symbols,
             )
             self.click_layer = lyr
             return lyr
@@ -228,21 +361,55 @@ class PhotoViewerPlus:
             return None
 
     def _set_pixmap(self, side: str, path: Path):
-        if not path.is_file():
+        # キー作成の stat が存在確認を兼ねる（通常ファイルでなければ None）
+        target_w = self.dock.image_width(side)
+        key = images.pixmap_key(path, target_w)
+        if key is None:
             self.dock.set_message(side, f"Image not found:\n{path}")
             return
-        pix = QPixmap(str(path))
-        if pix.isNull():
-            self.dock.set_message(side, f"Failed to open image:\n{path}")
+        # 同じ画像（パス・更新時刻・デコード幅とも同じ）が既に表示/デコード中なら何もしない
+        if key in (self.dock.painted_key(side), self.dock.pending_key(side)):
+            return
+        pix = images.find_cached(key)
+        if pix is not None:
+            self.dock.set_pixmap(side, pix, key)
             return
-        self.dock.set_pixmap(side, pix)
+        # デコードはワーカーで行い、終わるまでは前の画像を出したままにする
+        self.dock.set_pending(side, key)
+        self._prefetcher.request(key, path, target_w)
+
+    def _on_pixmap_loaded(self, key: str, pix: QPixmap):
+        dock = getattr(self, "dock", None)
+        if dock is None:
+            return
+        try:
+            for side in ("front", "back"):
+                if dock.pending_key(side) != key:
+                    continue
+                if pix.isNull():
+                    path = key.rsplit("|", 2)[0]
+                    dock.set_message(side, f"Failed to open image:\n{path}")
+                else:
+                    dock.set_pixmap(side, pix, key)
+        except RuntimeError:
+            # アンロード後に届いたデコード結果（ドックは破棄済み）
+            pass
+
+    def _on_image_resized(self, side: str):
+        # 表示幅がデコード幅を超えたときだけ、大きい幅で表示中の画像をデコードし直す
+        key = self.dock.painted_key(side)
+        if not key:
+            return
+        path, _mtime, bucket = key.rsplit("|", 2)
+        if bucket != "0" and images.width_bucket(self.dock.image_width(side)) > int(bucket):
+            self._set_pixmap(side, Path(path))
 
     def _update_name_labels(self, row: Row, disp_front: Optional[str] = None, disp_back: Optional[str] = None):
         p_front = resolve_path(self.img_dir, (disp_front if disp_front is not None else row.front) or "")
         p_back = resolve_path(self.img_dir, (disp_back if disp_back is not None else row.back) or "")
 
         def _kp_for_pic(pic: Optional[str]) -> Optional[str]:
-            key = (pic or "").strip().lower()
+            key = lookup_key(pic)
             if not key:
                 return None
             i = self._idx_by_pic.get(key)
@@ -291,8 +458,8 @@ class PhotoViewerPlus:
                 self.dock.setWindowTitle(base_title)
             return
 
-        kp = getattr(row, "kp", "") or ""
-        street = getattr(row, "street", "") or ""
+        kp = row.kp or ""
+        street = row.street or ""
 
         parts = []
         if kp:
@@ -308,21 +475,23 @@ class PhotoViewerPlus:
 
         self.dock.setWindowTitle(title)
 
-    def _select_features(self, feats):
-        if not (self.layer and feats):
-            return
-
-        ids = [f.id() for f in feats if f is not None]
-        if not ids:
+    def _select_features(self, ids: List[int]):
+        if not (self.layer and ids):
             return
 
         if self.auto_zoom:
+            canvas = self._canvas
             try:
-                iface.mapCanvas().zoomToFeatureIds(self.layer, ids)
-                iface.mapCanvas().zoomScale(500)
-                iface.mapCanvas().refresh()
+                # 同じ地物に寄せ済みで、その後パン・ズームされていなければ何もしない
+                key = tuple(ids)
+                last = self._last_zoom
+                if last is not None and last[0] == key and canvas.extent() == last[1]:
+                    return
+                canvas.zoomToFeatureIds(self.layer, ids)
+                canvas.zoomScale(500)
+                self._last_zoom = (key, canvas.extent())
             except Exception:
-                pass
+                self._last_zoom = None
 
     def show_image(self, idx: int):
         if not self.images:
@@ -331,8 +500,12 @@ class PhotoViewerPlus:
             self._update_kp_title(None)
             return
 
+        prev_index = self.current_index
         self.current_index = idx % len(self.images)
         row = self.images[self.current_index]
+        if abs(self.current_index - prev_index) > 1:
+            # 前後移動以外（ジャンプ・選択）では古い位置の先読みは不要
+            self._prefetcher.cancel_prefetch()
 
         try:
             self._update_kp_title(row)
@@ -363,17 +536,25 @@ class PhotoViewerPlus:
             self.dock.set_message("back", "No image")
 
         self._update_name_labels(row, disp_front, disp_back)
+        self._prefetch_neighbors(pos)
+
+        # 表示対象（画像名・座標・KP）が前回と同じならレイヤ側の更新は不要
+        display_key = (
+            disp_front, disp_back, row.kp,
+            row.lat_front, row.lon_front, row.lat_back, row.lon_back,
+        )
+        if display_key == self._last_display_key:
+            return
+        self._last_display_key = display_key
 
-        feats = []
         ff = lyrmod.find_feature_by_pic_or_coord(
             self.layer,
             disp_front,
             row.lat_front, row.lon_front,
             expected_side="front",
             tol=self.COORD_TOL,
+            lookup=self._ensure_point_lookup(),
         ) if disp_front else None
-        if ff:
-            feats.append(ff)
 
         fb = lyrmod.find_feature_by_pic_or_coord(
             self.layer,
@@ -381,15 +562,36 @@ class PhotoViewerPlus:
             row.lat_back, row.lon_back,
             expected_side="back",
             tol=self.COORD_TOL,
+            lookup=self._ensure_point_lookup(),
         ) if disp_back else None
-        if fb:
-            feats.append(fb)
+        ids = [f.id() for f in (ff, fb) if f is not None]
+
+        # 強調フラグ更新・ズーム・KP選択の間は描画を止め、最後に1回だけ描画する
+        # （ユーザーが描画をオフにしている場合や、外側ですでに止めている場合はそのまま）
+        canvas = self._canvas
+        prev = canvas.renderFlag()
+        if prev:
+            canvas.setRenderFlag(False)
+        try:
+            lyrmod.apply_front_back_selected(self.layer, ff, fb)
+            if ids:
+                self._select_features(ids)
 
-        lyrmod.apply_front_back_selected(self.layer, ff, fb)
-        if feats:
-            self._select_features(feats)
+            lyrmod.select_kp(self.layer, row.kp, lookup=self._ensure_point_lookup())
+        finally:
+            if prev:
+                canvas.setRenderFlag(True)
 
-        lyrmod.select_kp(self.layer, row.kp)
+    def _prefetch_neighbors(self, pos: int):
+        n = len(self.images)
+        if n < 2:
+            return
+        paths = []
+        for p in ((pos + 1) % n, (pos - 1) % n):
+            for nm in utils.resolve_display_images(self.images, p):
+                if nm:
+                    paths.append(resolve_path(self.img_dir, nm))
+        self._prefetcher.prefetch(paths, self.dock.image_width("front"))
 
     def next_image(self):
         self.show_image(self.current_index + 1)
@@ -398,40 +600,45 @@ class PhotoViewerPlus:
         self.show_image(self.current_index - 1)
 
     def force_disable_map_tools(self):
-        canvas = iface.mapCanvas()
+        canvas = self._canvas
         for attr in ("_click_tool", "_edit_tool"):
             tool = getattr(self, attr, None)
             if tool:
-                maptools.disable_current_tool(canvas, getattr(self, "_prev_map_tool", None))
+                maptools.disable_current_tool(canvas, self._prev_map_tool)
                 setattr(self, attr, None)
 
     def configure_and_load(self):
+        if self._csv_task is not None:
+            return  # 読込中
         try:
             csv_file, img_dir_sel = self._pick_paths()
-            from qgis.PyQt.QtWidgets import QProgressDialog
-            prog = QProgressDialog("Loading CSV", "Cancel", 0, 0, iface.mainWindow())
-            prog.setWindowModality(self._APP_MODAL)
-            prog.setMinimumDuration(400)
-
-            def _tick(i):
-                prog.setLabelText(f"Loading{i:,} rows…")
-                prog.setValue(0)
-                if prog.wasCanceled():
-                    raise Exception("Operation was canceled by the user")
-
-            try:
-                rows = io_mod.load_images_csv(csv_file, on_progress=_tick)
-            finally:
-                try:
-                    prog.close()
-                except Exception:
-                    pass
         except Exception as e:
             QMessageBox.critical(iface.mainWindow(), "PhotoViewer Configuration Error", str(e))
             return
 
+        # 読込は QGIS のタスクマネージャで行い、GUIスレッドは止めない
+        task = _CsvLoadTask(csv_file)
+        self._csv_task = task
+
+        def _failed(msg):
+            self._csv_task = None
+            QMessageBox.critical(iface.mainWindow(), "PhotoViewer Configuration Error", msg)
+
+        def _finished(rows):
+            self._csv_task = None
+            self._on_csv_loaded(rows, img_dir_sel)
+
+        task.loadFailed.connect(_failed)
+        task.rowsLoaded.connect(_finished)
+        QgsApplication.taskManager().addTask(task)
+
+    def _on_csv_loaded(self, rows: List[Row], img_dir_sel: str):
         self.images = rows
+        if Path(img_dir_sel) != self.img_dir:
+            utils.clear_resolve_path_cache()
+            images.clear_path_cache()
         self.img_dir = Path(img_dir_sel)
+        self._last_display_key = None
         self._rebuild_index()
 
         lyr = self._ensure_point_layer()
@@ -440,21 +647,9 @@ class PhotoViewerPlus:
         self.show_image(0)
 
     def _zoom_to_first_row(self):
-        if not self.images:
-            return
-
-        target_lon = None
-        target_lat = None
-        for r in self.images:
-            lon = r.lon_front if r.lon_front is not None else r.lon_back
-            lat = r.lat_front if r.lat_front is not None else r.lat_back
-            if lon is not None and lat is not None:
-                target_lon = lon
-                target_lat = lat
-                break
-
-        if target_lon is None or target_lat is None:
+        if not self.images or self._first_coord is None:
             return
+        target_lon, target_lat = self._first_coord
 
         pad = 0.01
         rect = QgsRectangle(
@@ -462,38 +657,125 @@ class PhotoViewerPlus:
             target_lon + pad, target_lat + pad,
         )
 
-        canvas = iface.mapCanvas()
+        canvas = self._canvas
         canvas.setExtent(rect)
         canvas.refresh()
 
+    def _coord_cell(self, x: float, y: float) -> Tuple[int, int]:
+        # COORD_TOL 幅のグリッドセル（±tol の点は隣接セルまでに収まる）
+        return (math.floor(x / self.COORD_TOL), math.floor(y / self.COORD_TOL))
+
     def _rebuild_index(self):
         self._idx_by_kp.clear()
         self._idx_by_pic.clear()
+        self._idx_by_coord.clear()
+
+        nan = math.nan
+        lon_f, lat_f, lon_b, lat_b = array("d"), array("d"), array("d"), array("d")
+
+        # ループ内は属性参照を避けてローカル名で回す（座標列とグリッドを1パスで作る）
+        idx_by_kp = self._idx_by_kp
+        idx_by_pic = self._idx_by_pic
+        idx_by_coord = self._idx_by_coord
+        coord_cell = self._coord_cell
+        first_coord = None
+        # KP は最初の行を採用する（setdefault なので後の行では上書きしない）
+        # 画像名は後の行で上書きする。前後の行から借りた画像の横に出す KP
+        # （_update_name_labels）が、その画像を持つ後ろ側の行の KP になるようにするため
+        kp_first = idx_by_kp.setdefault
 
         for i, r in enumerate(self.images):
-            if r.kp:
-                key = str(r.kp).strip().lower()
-                if key not in self._idx_by_kp:
-                    self._idx_by_kp[key] = i
-
-            for nm in (r.front, r.back):
-                k = (nm or "").strip().lower()
-                if k:
-                    self._idx_by_pic[k] = i
+            if r.kp_key:
+                kp_first(r.kp_key, i)
+            if r.front_key:
+                idx_by_pic[r.front_key] = i
+            if r.back_key:
+                idx_by_pic[r.back_key] = i
+
+            lon_f.append(nan if r.lon_front is None else r.lon_front)
+            lat_f.append(nan if r.lat_front is None else r.lat_front)
+            lon_b.append(nan if r.lon_back is None else r.lon_back)
+            lat_b.append(nan if r.lat_back is None else r.lat_back)
+
+            if first_coord is None:
+                lon = r.lon_front if r.lon_front is not None else r.lon_back
+                lat = r.lat_front if r.lat_front is not None else r.lat_back
+                if lon is not None and lat is not None:
+                    first_coord = (lon, lat)
+
+            for lon, lat in ((r.lon_front, r.lat_front), (r.lon_back, r.lat_back)):
+                if lon is not None and lat is not None:
+                    cell = idx_by_coord.setdefault(coord_cell(lon, lat), [])
+                    if not cell or cell[-1] != i:
+                        cell.append(i)
+
+        self._idx_any = {**idx_by_pic, **idx_by_kp}
+        self._lon_f, self._lat_f, self._lon_b, self._lat_b = lon_f, lat_f, lon_b, lat_b
+        self._first_coord = first_coord
+
+    def _find_row_by_coord(self, x: float, y: float) -> Optional[int]:
+        """front/back 座標が ±COORD_TOL で一致する最小の行番号（無ければ None）"""
+        tol = self.COORD_TOL
+        lon_f, lat_f, lon_b, lat_b = self._lon_f, self._lat_f, self._lon_b, self._lat_b
+        cx, cy = self._coord_cell(x, y)
+        best = None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for i in self._idx_by_coord.get((cx + dx, cy + dy), ()):
+                    if best is not None and i >= best:
+                        break
+                    # NaN（欠損）は比較が常に False になるので None 判定は不要
+                    if (
+                        (abs(lon_f[i] - x) <= tol and abs(lat_f[i] - y) <= tol) or
+                        (abs(lon_b[i] - x) <= tol and abs(lat_b[i] - y) <= tol)
+                    ):
+                        best = i
+        return best
 
     def _plot_all_points(self, layer):
         if not self.images:
             QMessageBox.information(iface.mainWindow(), "PhotoViewer", "CSV not loaded")
             return
 
-        def _info(n):
-            QMessageBox.information(iface.mainWindow(), "PhotoViewer", f"Plot completed: add {n} points.")
-
-        lyrmod.plot_all_points(layer, self.images, info_cb=_info)
+        # 一括追加の間は描画を止め、終わってから1回だけ描き直す（元から止まっていればそのまま）
+        added: List[int] = []
+        canvas = self._canvas
+        prev = canvas.renderFlag()
+        if prev:
+            canvas.setRenderFlag(False)
+        try:
+            lyrmod.plot_all_points(layer, self.images, info_cb=added.append)
+        finally:
+            if prev:
+                canvas.setRenderFlag(True)
+        layer.updateExtents()
+        layer.triggerRepaint()
+        if added:
+            QMessageBox.information(iface.mainWindow(), "PhotoViewer", f"Plot completed: add {added[0]} points.")
+
+        self._point_lookup = lyrmod.PointLookup(layer, tol=self.COORD_TOL)
         ext = layer.extent()
         if ext and not ext.isEmpty():
-            iface.mapCanvas().setExtent(ext)
-            iface.mapCanvas().refresh()
+            self._canvas.setExtent(ext)
+            self._canvas.refresh()
+
+    def _ensure_point_lookup(self) -> Optional[lyrmod.PointLookup]:
+        """PhotoPoints の索引（編集で捨てられていたら次に使うときに1回だけ作り直す）"""
+        if self._point_lookup is None and self.layer is not None:
+            try:
+                self._point_lookup = lyrmod.PointLookup(self.layer, tol=self.COORD_TOL)
+            except Exception:
+                self._point_lookup = None
+        return self._point_lookup
+
+    def _invalidate_point_lookup(self, *args):
+        self._point_lookup = None
+
+    def _on_point_attr_changed(self, fid, idx, value):
+        # is_sel などの強調フラグ更新では索引は変わらない
+        lookup = self._point_lookup
+        if lookup is not None and idx in lookup.key_fields:
+            self._point_lookup = None
 
     def _hook_layer(self, layer_obj):
         try:
@@ -502,7 +784,19 @@ class PhotoViewerPlus:
             pass
         layer_obj.selectionChanged.connect(self._on_layer_selection_changed)
 
-        prj = QgsProject.instance()
+        for sig, slot in (
+            (layer_obj.featureAdded, self._invalidate_point_lookup),
+            (layer_obj.featureDeleted, self._invalidate_point_lookup),
+            (layer_obj.geometryChanged, self._invalidate_point_lookup),
+            (layer_obj.attributeValueChanged, self._on_point_attr_changed),
+        ):
+            try:
+                sig.disconnect(slot)
+            except Exception:
+                pass
+            sig.connect(slot)
+
+        prj = self._project
         try:
             prj.layerWillBeRemoved.disconnect(self._on_layer_will_be_removed)
         except Exception:
@@ -512,52 +806,37 @@ class PhotoViewerPlus:
     def _on_layer_will_be_removed(self, layer_id: str):
         if self.layer and self.layer.id() == layer_id:
             self.layer = None
+            self._last_display_key = None
+            self._point_lookup = None
         if self.click_layer and self.click_layer.id() == layer_id:
             self.click_layer = None
 
     def _on_layer_selection_changed(self, *args):
-        if self.suspend_selection_signal or not self.layer or not self.images:
+        if not self.layer or not self.images:
             return
 
-        sel = list(self.layer.selectedFeatures())
-        if not sel:
+        # 先頭の1件だけ必要なので、選択全体をリスト化せずイテレータから取る
+        f = next(iter(self.layer.getSelectedFeatures()), None)
+        if f is None:
             return
-        f = sel[0]
 
-        try:
-            kp_val = (get_attr_safe(f, "kp", "") or "").strip().lower()
-            if kp_val and kp_val in self._idx_by_kp:
-                self.show_image(self._idx_by_kp[kp_val])
-                return
-        except Exception:
-            pass
-
-        for key in (FN.JPG, "pic_front", "pic_back"):
+        idx_any = self._idx_any
+        for key in ("kp", FN.JPG, "pic_front", "pic_back"):
             try:
-                nm = (f[key] or "").strip().lower()
-                if nm and nm in self._idx_by_pic:
-                    self.show_image(self._idx_by_pic[nm])
-                    return
+                k = lookup_key(get_attr_safe(f, key, ""))
             except Exception:
-                pass
+                continue
+            i = idx_any.get(k) if k else None
+            if i is not None:
+                self.show_image(i)
+                return
 
         try:
             pt = f.geometry().asPoint()
-            for i, r in enumerate(self.images):
-                if (
-                    r.lon_front is not None and r.lat_front is not None and
-                    abs(r.lon_front - pt.x()) <= self.COORD_TOL and
-                    abs(r.lat_front - pt.y()) <= self.COORD_TOL
-                ):
-                    self.show_image(i)
-                    return
-                if (
-                    r.lon_back is not None and r.lat_back is not None and
-                    abs(r.lon_back - pt.x()) <= self.COORD_TOL and
-                    abs(r.lat_back - pt.y()) <= self.COORD_TOL
-                ):
-                    self.show_image(i)
-                    return
+            i = self._find_row_by_coord(pt.x(), pt.y())
+            if i is not None:
+                self.show_image(i)
+                return
         except Exception:
             pass
 
@@ -579,73 +858,42 @@ class PhotoViewerPlus:
 
         selected_lc = {(k or "").strip().lower(): (v or "") for k, v in selected.items()}
         chosen_main = [k for k, v in selected_lc.items() if v]
+        # 項目名の正規化は項目ごとに1回（名前自体はキャッシュ済み）
+        filled = [(k, v) + _attr_keys(k) for k, v in selected.items() if v]
 
         results: List[Dict[str, str]] = []
 
-        def _parse_sub_vals(val: str) -> List[str]:
-            if not val:
-                return []
-            out: List[str] = []
-            for tok in [t.strip().lower() for t in val.split(",") if t.strip()]:
-                m = re.match(r"^(.*?)(?:\s*=\s*(\d+))?$", tok)
-                if not m:
-                    continue
-                label = (m.group(1) or "").strip()
-                if not label:
-                    continue
-                n = int(m.group(2)) if m.group(2) else 1
-                n = max(1, min(n, 999))
-                out.extend([label] * n)
-            return out
-
-        total_items = sum(len(_parse_sub_vals(selected_lc.get(main, ""))) for main in chosen_main)
+        sub_vals_by_main = {main: _parse_sub_vals(selected_lc.get(main, "")) for main in chosen_main}
+        total_items = sum(len(v) for v in sub_vals_by_main.values())
         will_be_multi = total_items >= 2
 
         if chosen_main:
             for main in chosen_main:
-                sub_vals = _parse_sub_vals(selected_lc.get(main, ""))
+                sub_vals = sub_vals_by_main[main]
 
                 if sub_vals:
                     for sub in sub_vals:
                         d: Dict[str, str] = {FN.CATEGORY: main}
-                        for k, v in selected.items():
-                            if not v:
-                                continue
-                            key = normalize_header(k)
-                            low = key.lower()
-                            if low in ("category", "categories", "カテゴリ", "カテゴリー"):
+                        for k, v, norm, field in filled:
+                            if norm in _CATEGORY_KEYS:
                                 continue
                             if k.lower() == main:
-                                key = self.main_to_field.get(main, self.main_to_field.get(k, key))
+                                key = self.main_to_field.get(main, self.main_to_field.get(k, norm))
                                 d[key] = sub
                                 continue
-                            if key in ("lat", "lon", "jpg"):
-                                key = f"user_{key}"
-                            d[key] = v
+                            d[field] = v
                         if will_be_multi:
                             d["subcat"] = "combined"
                         results.append(d)
                 else:
                     d: Dict[str, str] = {FN.CATEGORY: main}
-                    for k, v in selected.items():
-                        if not v:
-                            continue
-                        key = normalize_header(k)
-                        if key in ("lat", "lon", "jpg"):
-                            key = f"user_{key}"
-                        d[key] = v
+                    for _k, v, _norm, field in filled:
+                        d[field] = v
                     if will_be_multi:
                         d["subcat"] = "combined"
                     results.append(d)
         else:
-            d: Dict[str, str] = {}
-            for k, v in selected.items():
-                if not v:
-                    continue
-                key = normalize_header(k)
-                if key in ("lat", "lon", "jpg"):
-                    key = f"user_{key}"
-                d[key] = v
+            d: Dict[str, str] = {field: v for _k, v, _norm, field in filled}
             if d:
                 if "," in (selected.get("category", "") or ""):
                     d["subcat"] = "combined"
@@ -659,7 +907,7 @@ class PhotoViewerPlus:
             return
 
         maptools.toggle_tool_mode(
-            self, iface.mapCanvas(), lyr,
+            self, self._canvas, lyr,
             "_click_tool", "_prev_map_tool",
             maptools.AddPointTool,
             "● Add Click mode (ON)", "● Add Click mode", self.add_btn,
@@ -672,7 +920,7 @@ class PhotoViewerPlus:
             return
 
         maptools.toggle_tool_mode(
-            self, iface.mapCanvas(), lyr,
+            self, self._canvas, lyr,
             "_edit_tool", "_prev_map_tool",
             maptools.EditPointTool,
             "✎ Edit Click mode (ON)", "✎ Edit Click mode", self.edit_btn,
@@ -680,6 +928,8 @@ class PhotoViewerPlus:
         )
 
     def _export_clicks_csv(self):
+        if self._export_task is not None:
+            return  # 書き出し中
         lyr = self._ensure_click_layer_or_msg("Export CSV(Clicks)")
         if not lyr:
             return
@@ -718,13 +968,7 @@ class PhotoViewerPlus:
             )
             sel_only = (reply == QMessageBox.Yes)
 
-        try:
-            out_csv, meta_path = io_mod.export_clicks_csv(lyr, out_csv, sel_only, meta)
-            settings.setValue(self.SKEY_LAST_EXPORT_CLICKS, out_csv)
-            if meta_path:
-                settings.setValue(f"{SKEY_ROOT}last_clicks_meta", meta_path)
-            QMessageBox.information(iface.mainWindow(), "Export CSV (Clicks)", f"Saved:\n{out_csv}")
-        except Exception as e:
+        def _error(e):
             QMessageBox.critical(
                 iface.mainWindow(),
                 "Save CSV Error (Clicks)",
@@ -732,6 +976,35 @@ class PhotoViewerPlus:
                 "Try saving to a writable folder (e.g., Documents) or closing apps that may have the file open (e.g., Excel)."
             )
 
+        # 書き出しは QGIS のタスクマネージャで行い、大きなレイヤでも画面を止めない
+        try:
+            out_csv = io_mod.clicks_csv_path(out_csv)
+            task = utils.export_layer_to_csv_task(lyr, out_csv, only_selected=sel_only)
+        except Exception as e:
+            _error(e)
+            return
+
+        def _complete(_path):
+            self._export_task = None
+            try:
+                meta_path = io_mod.write_clicks_meta(out_csv, meta)
+            except Exception as e:
+                _error(e)
+                return
+            settings.setValue(self.SKEY_LAST_EXPORT_CLICKS, out_csv)
+            if meta_path:
+                settings.setValue(f"{SKEY_ROOT}last_clicks_meta", meta_path)
+            QMessageBox.information(iface.mainWindow(), "Export CSV (Clicks)", f"Saved:\n{out_csv}")
+
+        def _failed(_code, msg):
+            self._export_task = None
+            _error(msg or "Failed to export CSV")
+
+        task.writeComplete.connect(_complete)
+        task.errorOccurred.connect(_failed)
+        self._export_task = task
+        QgsApplication.taskManager().addTask(task)
+
     def _import_clicks_csv(self):
         lyr = self._ensure_click_layer_or_msg("PhotoClicks")
         if not lyr:
@@ -747,7 +1020,6 @@ class PhotoViewerPlus:
         if not csv_file:
             return
 
-        from qgis.PyQt.QtWidgets import QProgressDialog
         prog = QProgressDialog("Loading Clicks CSV…", "Cancel", 0, 0, iface.mainWindow())
         prog.setWindowModality(self._APP_MODAL)
         prog.setMinimumDuration(400)
@@ -765,12 +1037,12 @@ class PhotoViewerPlus:
             lyr.triggerRepaint()
             ext = lyr.extent()
             if ext and not ext.isEmpty():
-                iface.mapCanvas().setExtent(ext)
-                iface.mapCanvas().refresh()
+                self._canvas.setExtent(ext)
+                self._canvas.refresh()
 
             idx = None
             if target_kp:
-                idx = self._idx_by_kp.get(target_kp.strip().lower())
+                idx = self._idx_by_kp.get(lookup_key(target_kp))
 
             msg = f"Import Completed: added {added} / skipped {skipped}."
             if target_kp:
@@ -828,13 +1100,18 @@ class PhotoViewerPlus:
         disp_front = disp_front or row.front
         disp_back = disp_back or row.back
 
-        for p in (
-            resolve_path(self.img_dir, disp_front or ""),
-            resolve_path(self.img_dir, disp_back or "")
-        ):
+        # front/back が同じ画像なら1回だけ開く
+        opened = set()
+        for name in (disp_front, disp_back):
+            if not name:
+                continue
+            p = os.fspath(resolve_path(self.img_dir, name))
+            if p in opened:
+                continue
+            opened.add(p)
             try:
-                if p.is_file():
-                    QDesktopServices.openUrl(QUrl.fromLocalFile(str(p)))
+                if os.path.isfile(p):
+                    QDesktopServices.openUrl(QUrl.fromLocalFile(p))
             except Exception:
                 pass
 